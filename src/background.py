@@ -0,0 +1,163 @@
+import multiprocessing
+import queue
+import threading
+import time
+
+from batch import make_solver
+from stats import SearchStats
+
+#############################################
+#########   Background Solving   ############
+#############################################
+# Runs the solver of the GUI outside the render loop: a daemon worker process loads the databases,
+# keeps the solver and solves one state at a time, while the GUI polls for progress and results.
+# Solves requested before the databases are loaded wait in the worker, the GUI never blocks.
+# Without the fork start method (Windows, macOS) the worker is a thread instead, since a spawned
+# process would import main.py and open a second window.
+
+def _background_loop(method, load, time_budget, cancel, progress, requests, results):
+    start = time.perf_counter()
+    try:
+        heuristic = load()
+        solver = make_solver(method, heuristic, time_budget = time_budget)
+    except Exception as e:
+        # Any failure goes back to the GUI, a worker that just dies would leave it waiting
+        progress.put({'event': 'error', 'error': _describe(e)})
+        return
+    progress.put({'event': 'ready', 'time': time.perf_counter() - start})
+    # Both solvers stop when the GUI cancels, IDA_star also reports every iteration
+    solver.cancel = cancel
+    if method == 'ida':
+        solver.stats = SearchStats([progress.put])
+    while True:
+        state = requests.get()
+        if state is None:
+            return
+        try:
+            moves = solver.run(state)
+        except Exception as e:
+            results.put((None, _describe(e)))
+            continue
+        status = getattr(moves, 'status', None)
+        if status is None:
+            status = 'solved' if moves else 'cancelled' if cancel.is_set() else 'exhausted'
+        results.put((list(moves), status))
+
+def _describe(error):
+    return str(error) if isinstance(error, (OSError, ValueError)) else f'{type(error).__name__}: {error}'
+
+class BackgroundSolver(object):
+    def __init__(self, method, load, time_budget = None):
+        """
+        Input:
+            method (str): 'ida' or 'kociemba' (see batch.make_solver)
+            load (function): Returns the heuristic for IDA_star or the tables of the two-phase solver, called by the worker
+            time_budget (float): Seconds the two-phase solver improves its solution (Default: None)
+
+        Description:
+            Starts the worker, which loads the databases first. It is a daemon, so it never keeps
+            the application from exiting. Only one solve runs at a time.
+            Once the databases are loaded self.ready is set and self.load_time holds the seconds it took,
+            if loading fails self.error holds the reason.
+
+        Output:
+            None
+        """
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # Started right away, a process forked later would copy the window of the GUI
+            context = multiprocessing.get_context('fork')
+            self.cancel_flag, self.progress = context.Event(), context.Queue()
+            self.requests, self.results = context.Queue(), context.Queue()
+            worker = context.Process
+        else:
+            self.cancel_flag, self.progress = threading.Event(), queue.Queue()
+            self.requests, self.results = queue.Queue(), queue.Queue()
+            worker = threading.Thread
+        self.worker = worker(target=_background_loop, daemon=True,
+                             args=(method, load, time_budget, self.cancel_flag, self.progress, self.requests, self.results))
+        self.worker.start()
+        self.ready = False
+        self.load_time = None
+        self.error = None
+        self.running = False
+        self.started = None
+        self.last = None
+
+    def solve(self, state):
+        """
+        Input:
+            state (str): representing the current state of the cube
+
+        Description:
+            Starts solving the state in the background (see poll).
+
+        Output:
+            None
+        """
+        self.drain()
+        self.cancel_flag.clear()
+        self.last = None
+        self.started = time.perf_counter()
+        self.running = True
+        self.requests.put(state)
+
+    def busy(self):
+        return self.running
+
+    def cancel(self):
+        self.cancel_flag.set()
+
+    def drain(self):
+        # Keeps the last iteration record (see stats.SearchStats) for the progress display
+        while True:
+            try:
+                record = self.progress.get_nowait()
+            except queue.Empty:
+                return self.last
+            if record['event'] == 'iteration':
+                self.last = record
+            elif record['event'] == 'ready':
+                self.ready, self.load_time = True, record['time']
+            elif record['event'] == 'error':
+                self.error = record['error']
+
+    def poll(self):
+        """
+        Input:
+            None
+
+        Description:
+            Checks the running solve without waiting.
+            Raises a ValueError if the solver could not solve the state, the databases could not be loaded
+            or the worker is gone.
+
+        Output:
+            Tuple (moves, status) once the solve is done, else None.
+        """
+        self.drain()
+        if not self.running:
+            return None
+        if self.error is not None:
+            self.running = False
+            raise ValueError(f'the databases could not be loaded: {self.error}')
+        try:
+            moves, status = self.results.get_nowait()
+        except queue.Empty:
+            if self.worker.is_alive():
+                return None
+            # A worker killed from outside (e.g. by the OOM killer) can not report anything
+            self.running = False
+            self.drain()
+            raise ValueError(f'the solver worker stopped: {self.error}' if self.error is not None else
+                             'the solver worker stopped unexpectedly')
+        self.running = False
+        if moves is None:
+            raise ValueError(status)
+        return moves, status
+
+    def elapsed(self):
+        return 0 if self.started is None else time.perf_counter() - self.started
+
+    def close(self):
+        self.cancel_flag.set()
+        self.requests.put(None)
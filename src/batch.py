@@ -0,0 +1,241 @@
+import argparse
+import ast
+import contextlib
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from coordinates import CoordinateEngine
+from cube import RubiksCube, move_actions
+from database import HeuristicDB
+from kociemba import Kociemba, load_two_phase_tables
+from pattern_db import CoordinateHeuristic, PatternHeuristic, load_pattern_dbs
+from solver import IDA_star, extend_heuristic_db
+
+#############################################
+########   Headless Batch Solving   #########
+#############################################
+# Reads one cube per line, either a state in the RubiksCube.stringify() format or a move list
+# like the one RubiksCube.shuffle() returns ([('v', 0, 1), ...], JSON lists work as well),
+# and writes one JSON line per cube:
+#   {"index": 0, "moves": [["h", 0, 1], ...], "length": 12, "nodes": 4711, "time": 0.52}
+# Lines that can not be read or solved give {"index": ..., "error": "..."} instead.
+# The index is the number of the input line counted from 0, blank lines are skipped but counted.
+# IDA* results also carry "status" and "lower_bound" (see solver.SolveResult); with a time budget
+# a search that runs out of time gives its status and lower bound with the error.
+# The solver is selected per call: 'ida' (IDA_star, optimal) or 'kociemba' (two-phase, any depth).
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+MAX_MOVES = 7
+METHODS = ['ida', 'kociemba']
+
+def load_heuristic(directory = DATA_DIR, max_moves = MAX_MOVES, build = True, rebuild = False, coordinates = False):
+    """
+    Input:
+        directory (str): Directory of the database files (Default: the source directory)
+        max_moves (int): Depth of the heuristic database (Default: 7)
+        build (bool): Build missing or mismatched databases, extend shallower ones (Default: True)
+        rebuild (bool): Build the heuristic database from scratch even if it exists (Default: False)
+        coordinates (bool): Search on coordinates with the pattern databases only (Default: False)
+
+    Description:
+        Opens the heuristic database (heuristic.db, canonical states only) and the pattern
+        databases, building them first if needed (see solver.extend_heuristic_db).
+        With coordinates the heuristic database is left out and IDA_star searches with
+        the coordinate engine, several times faster per node (see coordinates.py).
+
+    Output:
+        pattern_db.PatternHeuristic combining all of them, or pattern_db.CoordinateHeuristic.
+    """
+    if coordinates:
+        return CoordinateHeuristic(load_pattern_dbs(directory, build = build), CoordinateEngine(directory, build = build))
+
+    cube = RubiksCube(n=3)
+    actions = move_actions(cube.n)
+    path = os.path.join(directory, 'heuristic.db')
+
+    if rebuild:
+        _remove_heuristic_db(path)
+    h_db = None
+    if build:
+        # A shallower database is extended by the missing layers only
+        try:
+            h_db = extend_heuristic_db(path, max_moves, cube.stringify(), actions, cube.colors, canonical = True)
+        except ValueError as e:
+            print(f'WARNING - {e}, rebuilding the heuristic database')
+            _remove_heuristic_db(path)
+            h_db = extend_heuristic_db(path, max_moves, cube.stringify(), actions, cube.colors, canonical = True)
+    elif os.path.exists(path):
+        h_db = HeuristicDB(path, n=cube.n, actions=actions, colors=cube.colors, canonical=True)
+
+    return PatternHeuristic(load_pattern_dbs(directory, build = build), h_db)
+
+def _remove_heuristic_db(path):
+    for p in [path, f'{path}.frontier']:
+        if os.path.exists(p):
+            os.remove(p)
+
+def parse_cube(line, n = 3):
+    """
+    Input:
+        line (str): A state string or a move list
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Reads one input line. Move lists are applied to a solved cube.
+        Raises a ValueError if the line is neither.
+
+    Output:
+        The state string (see RubiksCube.stringify).
+    """
+    line = line.strip()
+    cube = RubiksCube(n=n)
+    if line.startswith('['):
+        try:
+            moves = ast.literal_eval(line)
+        except (ValueError, SyntaxError):
+            raise ValueError(f'can not read the move list {line[:40]!r}') from None
+        actions = set(move_actions(n))
+        for m in moves:
+            if not isinstance(m, (list, tuple)) or tuple(m) not in actions:
+                raise ValueError(f'{m!r} is not a valid move')
+            cube.twist(tuple(m))
+        return cube.stringify()
+
+    if len(line) != 6 * n * n or any(line.count(c) != n * n for c in cube.colors):
+        raise ValueError(f'{line[:60]!r} is not a {n}x{n} state')
+    return line
+
+def make_solver(method = 'ida', heuristic = None, max_depth = None, time_budget = None):
+    """
+    Input:
+        method (str): 'ida' or 'kociemba' (Default: 'ida')
+        heuristic: Heuristic for IDA_star or the tables of the two-phase solver (Default: None, loaded)
+        max_depth (int): Longest solution searched for (Default: None, the default of the solver)
+        time_budget (float): Seconds the two-phase solver improves its solution, or IDA* may search (Default: None)
+
+    Description:
+        Creates the solver of the method.
+
+    Output:
+        IDA_star or kociemba.Kociemba object.
+    """
+    if method == 'kociemba':
+        tables = heuristic if heuristic is not None else load_two_phase_tables(DATA_DIR)
+        return Kociemba(tables, max_depth or 30, time_budget = time_budget)
+    if method != 'ida':
+        raise ValueError(f'unknown method {method!r}, expected one of {METHODS}')
+    return IDA_star(heuristic if heuristic is not None else load_heuristic(), max_depth or 20, time_budget = time_budget)
+
+def _solve(solver, index, line, **budget):
+    try:
+        state = parse_cube(line)
+    except ValueError as e:
+        return {'index': index, 'error': str(e)}
+    start = time.perf_counter()
+    try:
+        moves = solver.run(state, **budget)
+    except ValueError as e:
+        return {'index': index, 'error': str(e)}
+    status = {}
+    if hasattr(moves, 'status'):
+        status = {'status': moves.status, 'lower_bound': moves.lower_bound}
+    if not moves and not RubiksCube(n=3, state=state).solved():
+        if status.get('status', 'exhausted') != 'exhausted':
+            return {'index': index, 'error': f'search stopped ({moves.status}) before a solution was found', **status}
+        return {'index': index, 'error': f'no solution within {solver.max_depth} moves'}
+    return {
+        'index': index,
+        'moves': [list(m) for m in moves],
+        'length': len(moves),
+        'nodes': solver.nodes,
+        'time': round(time.perf_counter() - start, 6),
+        **status
+    }
+
+# Solver of a batch worker process (see _init_batch_worker)
+_batch_worker = {}
+
+def _init_batch_worker(method, heuristic, max_depth, time_budget):
+    _batch_worker['solver'] = make_solver(method, heuristic, max_depth, time_budget)
+
+def _solve_in_worker(index, line):
+    return _solve(_batch_worker['solver'], index, line)
+
+def solve_many(lines, heuristic = None, workers = 1, max_depth = None, method = 'ida', time_budget = None):
+    """
+    Input:
+        lines (iterable): State strings or move lists, one cube per item
+        heuristic: Heuristic for IDA_star or the tables of the two-phase solver (Default: None, loaded)
+        workers (int): Number of solving processes, None for one per core (Default: 1)
+        max_depth (int): Longest solution searched for (Default: None, the default of the solver)
+        method (str): 'ida' or 'kociemba' (Default: 'ida')
+        time_budget (float): Seconds the two-phase solver improves every solution, or IDA* may search for it (Default: None)
+
+    Description:
+        Solves a stream of cubes. Results come back in input order, and at most
+        four cubes per worker are in flight, so memory stays bounded for any input length.
+        Blank lines are skipped, the index of a result is the number of its line (from 0).
+
+    Output:
+        Generator of result dictionaries (see the module comment).
+    """
+    if heuristic is None:
+        heuristic = load_two_phase_tables(DATA_DIR) if method == 'kociemba' else load_heuristic()
+    workers = workers or os.cpu_count() or 1
+
+    if workers == 1:
+        solver = make_solver(method, heuristic, max_depth, time_budget)
+        for index, line in enumerate(lines):
+            if line.strip():
+                yield _solve(solver, index, line)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                             initargs=(method, heuristic, max_depth, time_budget)) as pool:
+        pending = deque()
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            pending.append(pool.submit(_solve_in_worker, index, line))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Solve Rubik\'s cubes without the GUI and write one JSON line per cube.')
+    parser.add_argument('input', nargs='?', default='-', help='file with one state or move list per line (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='JSONL output file (default: stdout)')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='solving processes, 0 for one per core (default: 1)')
+    parser.add_argument('-m', '--method', choices=METHODS, default='ida', help='optimal IDA* or the two-phase solver for deep scrambles (default: ida)')
+    parser.add_argument('--max-depth', type=int, help='longest solution searched for (default: 20 for ida, 30 face moves for kociemba)')
+    parser.add_argument('--time-budget', type=float, help='seconds the two-phase solver keeps improving every solution, or IDA* may search for one')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory of the heuristic and pattern databases')
+    parser.add_argument('--no-build', action='store_true', help='fail instead of building missing databases')
+    parser.add_argument('--coordinates', action='store_true', help='ida searches on coordinates with the pattern databases only (faster per node)')
+    args = parser.parse_args(argv)
+
+    # Keep the build reports out of the JSONL output
+    with contextlib.redirect_stdout(sys.stderr):
+        if args.method == 'kociemba':
+            heuristic = load_two_phase_tables(args.data_dir, build = not args.no_build)
+        else:
+            heuristic = load_heuristic(args.data_dir, build = not args.no_build, coordinates = args.coordinates)
+    source = sys.stdin if args.input == '-' else open(args.input)
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for result in solve_many(source, heuristic, args.workers or None, args.max_depth, args.method, args.time_budget):
+            target.write(json.dumps(result) + '\n')
+            target.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+if __name__ == '__main__':
+    main()
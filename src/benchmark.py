@@ -0,0 +1,546 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+from batch import DATA_DIR, load_heuristic
+from coordinates import CoordinateEngine
+from cube import RubiksCube, encode_state, move_actions, move_table
+from database import HeuristicDB
+from kociemba import load_two_phase_tables
+from pattern_db import CoordinateHeuristic, load_pattern_dbs
+from reduction import ReductionSolver
+from sampling import LayerSampler, random_states
+from solver import IDA_star, build_heuristic_db, vector
+from stats import SearchStats
+
+#############################################
+###########   Benchmark Suite   #############
+#############################################
+# python benchmark.py run -o results.json              measure everything
+# python benchmark.py compare baseline.json results.json  flag regressions
+#
+# Every metric is stored as {"value": ..., "unit": ..., "better": "higher", "lower" or "equal"},
+# "equal" marks an invariant (like the number of states of a database) that must not change at all.
+# Scrambles come from RubiksCube.shuffle with a fixed seed per depth, so every run
+# (and every machine) solves the same corpus.
+
+SEED = 2023
+DEPTHS = [2, 4, 6, 8, 10, 12]
+DB_DEPTHS = [4, 5, 6]
+SIZES = [2, 3, 4, 5, 6, 7]
+THRESHOLD = 0.1
+
+def scramble_corpus(depth, count, seed = SEED, n = 3):
+    """
+    Input:
+        depth (int): Number of scramble moves
+        count (int): Number of scrambles
+        seed (int): Seed of the corpus (Default: SEED)
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Generates scrambled states with RubiksCube.shuffle. The random generator is seeded
+        with the seed and the depth, and its previous state is restored afterwards.
+
+    Output:
+        List of state strings.
+    """
+    saved = random.getstate()
+    random.seed(seed * 1000 + depth)
+    corpus = []
+    for _ in range(count):
+        cube = RubiksCube(n=n)
+        cube.shuffle(l_rot = depth, u_rot = depth)
+        corpus.append(cube.stringify())
+    random.setstate(saved)
+    return corpus
+
+def _metric(value, unit, better):
+    return {'value': value, 'unit': unit, 'better': better}
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def bench_moves(count = 200000):
+    """
+    Input:
+        count (int): Number of moves to apply (Default: 200000)
+
+    Description:
+        Measures the move rate of the flat engine, of RubiksCube.twist and,
+        with NumPy, of the vectorized engine (see vector.apply_moves).
+
+    Output:
+        Dictionary of metrics.
+    """
+    moves = list(move_table(3).values())
+    state = encode_state(RubiksCube(n=3).stringify())[0]
+    start = time.perf_counter()
+    for i in range(count):
+        state = bytes(moves[i % len(moves)](state))
+    flat = count / (time.perf_counter() - start)
+
+    cube = RubiksCube(n=3)
+    actions = move_actions(3)
+    start = time.perf_counter()
+    for i in range(count // 10):
+        cube.twist(actions[i % len(actions)])
+    twist = count // 10 / (time.perf_counter() - start)
+    results = {'moves.flat': _metric(flat, 'moves/s', 'higher'), 'moves.twist': _metric(twist, 'moves/s', 'higher')}
+
+    if vector is not None:
+        indices = vector.move_indices(3)
+        states = vector.apply_moves(vector.to_array([state]), indices)
+        states = vector.apply_moves(states, indices)[:count // len(indices)]
+        start = time.perf_counter()
+        vector.apply_moves(states, indices)
+        results['moves.vector'] = _metric(len(states) * len(indices) / (time.perf_counter() - start), 'moves/s', 'higher')
+    return results
+
+def bench_sizes(sizes = SIZES, count = 100000):
+    """
+    Input:
+        sizes (list): Cube sizes (Default: SIZES)
+        count (int): Number of moves to apply per size (Default: 100000)
+
+    Description:
+        Measures the move rate of the flat engine and, with NumPy, of the vectorized
+        engine for every cube size. Moves of bigger cubes move more facelets, the rate in
+        facelets per second shows how well the engine scales.
+
+    Output:
+        Dictionary of metrics.
+    """
+    results = {}
+    for n in sizes:
+        moves = list(move_table(n).values())
+        state = encode_state(RubiksCube(n=n).stringify())[0]
+        start = time.perf_counter()
+        for i in range(count):
+            state = bytes(moves[i % len(moves)](state))
+        flat = count / (time.perf_counter() - start)
+        results[f'moves.n{n}.flat'] = _metric(flat, 'moves/s', 'higher')
+        results[f'moves.n{n}.flat_facelets'] = _metric(flat * len(state), 'facelets/s', 'higher')
+
+        if vector is not None:
+            indices = vector.move_indices(n)
+            states = vector.apply_moves(vector.to_array([state], n), indices)
+            states = states[:max(1, count // len(indices))]
+            start = time.perf_counter()
+            vector.apply_moves(states, indices)
+            results[f'moves.n{n}.vector'] = _metric(len(states) * len(indices) / (time.perf_counter() - start), 'moves/s', 'higher')
+    return results
+
+def bench_reduction(tables, sizes = SIZES, count = 5, seed = SEED):
+    """
+    Input:
+        tables (dict): The tables of kociemba.load_two_phase_tables
+        sizes (list): Cube sizes (Default: SIZES)
+        count (int): Scrambles per size (Default: 5)
+        seed (int): Seed of the corpus (Default: SEED)
+
+    Description:
+        Solves deep scrambles (20*n moves) of every size with the ReductionSolver and
+        measures the mean latency and solution length per size.
+
+    Output:
+        Dictionary of metrics.
+    """
+    results = {}
+    for n in sizes:
+        latencies, lengths = [], []
+        for state in scramble_corpus(20 * n, count, seed, n):
+            solver = ReductionSolver(tables)
+            start = time.perf_counter()
+            lengths.append(len(solver.run(state)))
+            latencies.append(time.perf_counter() - start)
+        results[f'reduction.n{n}.latency'] = _metric(sum(latencies) / count * 1e3, 'ms', 'lower')
+        results[f'reduction.n{n}.length'] = _metric(sum(lengths) / count, 'moves', 'lower')
+    return results
+
+def bench_stringify(count = 100000):
+    """
+    Input:
+        count (int): Number of conversions (Default: 100000)
+
+    Description:
+        Measures the cost of RubiksCube.stringify and of parsing a state string (encode_state).
+
+    Output:
+        Dictionary of metrics.
+    """
+    cube = RubiksCube(n=3)
+    cube.twist(('h', 0, 1))
+    start = time.perf_counter()
+    for _ in range(count):
+        s = cube.stringify()
+    stringify = (time.perf_counter() - start) / count * 1e6
+    start = time.perf_counter()
+    for _ in range(count):
+        encode_state(s, cube.colors)
+    parse = (time.perf_counter() - start) / count * 1e6
+    return {'stringify': _metric(stringify, 'us', 'lower'), 'parse': _metric(parse, 'us', 'lower')}
+
+def bench_state_keys(count = 200000):
+    """
+    Input:
+        count (int): Number of child states (Default: 200000)
+
+    Description:
+        Measures the cost of keying a child state: the bytes key the transposition table
+        of IDA_star uses (child and move context), and with NumPy the deduplication of a
+        layer by rows (vector.unique) against the deduplication by Zobrist hashes
+        (vector.unique_hashed).
+
+    Output:
+        Dictionary of metrics.
+    """
+    table = move_table(3)
+    actions = list(table)
+    state = encode_state(RubiksCube(n=3).stringify())[0]
+    start = time.perf_counter()
+    for i in range(count):
+        a = actions[i % len(actions)]
+        bytes(table[a](state)) + b'\x01'
+    key_bytes = (time.perf_counter() - start) / count * 1e6
+    results = {'keys.bytes': _metric(key_bytes, 'us', 'lower')}
+
+    if vector is not None:
+        indices = vector.move_indices(3)
+        parents = vector.apply_moves(vector.apply_moves(vector.to_array([state]), indices), indices)
+        parents = vector.apply_moves(parents, indices)[:count // len(indices)]
+        children = vector.apply_moves(parents, indices)
+        start = time.perf_counter()
+        vector.unique(children)
+        rows = len(children) / (time.perf_counter() - start)
+        start = time.perf_counter()
+        vector.unique_hashed(children, vector.child_hashes(parents, vector.zobrist(parents), indices))
+        hashed = len(children) / (time.perf_counter() - start)
+        results['dedupe.rows'] = _metric(rows, 'states/s', 'higher')
+        results['dedupe.zobrist'] = _metric(hashed, 'states/s', 'higher')
+    return results
+
+def bench_sampling(heuristic, count = 200000, depth = 5, seed = SEED):
+    """
+    Input:
+        heuristic: The heuristic of the solver benchmark, its database is sampled (see load_heuristic)
+        count (int): Number of uniformly random states (Default: 200000)
+        depth (int): Distance of the sampled database states (Default: 5)
+        seed (int): Seed of the generators (Default: SEED)
+
+    Description:
+        Measures the rate of the random state generators (see sampling.py): uniformly random
+        states and states exactly depth moves from solved.
+
+    Output:
+        Dictionary of metrics.
+    """
+    start = time.perf_counter()
+    random_states(count, seed)
+    results = {'sample.uniform': _metric(count / (time.perf_counter() - start), 'states/s', 'higher')}
+    table = getattr(heuristic, 'table', None)
+    if table is not None:
+        sampler = LayerSampler(table, seed)
+        sampler.layer(depth)
+        start = time.perf_counter()
+        sampler.states(depth, count // 100)
+        results['sample.depth'] = _metric(count // 100 / (time.perf_counter() - start), 'states/s', 'higher')
+    return results
+
+def bench_optimality(count = 20, seed = SEED):
+    """
+    Input:
+        count (int): Scrambles of the corpus (Default: 20)
+        seed (int): Seed of the corpus (Default: SEED)
+
+    Description:
+        Checks that IDA_star with a table of build_heuristic_db that is not canonical finds optimal
+        solutions: a middle slice and the outer layer next to it turned the same way are one turn
+        of the other outer layer, and the solutions of 5 move scrambles are as long as with a canonical table.
+
+    Output:
+        Dictionary of metrics (both compared for equality).
+    """
+    solved, actions = RubiksCube(n=3).stringify(), move_actions(3)
+    raw = build_heuristic_db(solved, actions, 3, stats = SearchStats())
+    canonical = build_heuristic_db(solved, actions, 3, canonical = True, stats = SearchStats())
+    cube = RubiksCube(n=3)
+    cube.twist(('v', 1, 1))
+    cube.twist(('v', 0, 1))
+    one_move = len(IDA_star(raw).run(cube.stringify()))
+    longer = sum(len(IDA_star(raw).run(s)) != len(IDA_star(canonical, canonical = True).run(s))
+                 for s in scramble_corpus(5, count, seed))
+    return {'check.raw_table.one_move': _metric(one_move, 'moves', 'equal'),
+            'check.raw_table.not_optimal': _metric(longer, 'solves', 'equal')}
+
+def bench_solver(heuristic, depths = DEPTHS, count = 10, seed = SEED):
+    """
+    Input:
+        heuristic: Heuristic for IDA_star
+        depths (list): Scramble depths (Default: DEPTHS)
+        count (int): Scrambles per depth (Default: 10)
+        seed (int): Seed of the corpus (Default: SEED)
+
+    Description:
+        Solves the corpus of every depth with IDA_star and measures the latency
+        percentiles per depth and the generated nodes per second over all solves.
+
+    Output:
+        Dictionary of metrics.
+    """
+    results, nodes, total = {}, 0, 0
+    for depth in depths:
+        latencies = []
+        for state in scramble_corpus(depth, count, seed):
+            solver = IDA_star(heuristic)
+            start = time.perf_counter()
+            solver.run(state)
+            latencies.append(time.perf_counter() - start)
+            nodes += solver.nodes
+        total += sum(latencies)
+        for p in (50, 90, 99):
+            results[f'solve.depth{depth}.p{p}'] = _metric(_percentile(latencies, p) * 1e3, 'ms', 'lower')
+    results['solve.nodes_per_second'] = _metric(nodes / total if total else 0, 'nodes/s', 'higher')
+    return results
+
+def bench_coordinates(directory = DATA_DIR, depths = DEPTHS, count = 10, seed = SEED, moves = 200000):
+    """
+    Input:
+        directory (str): Directory of the database files (Default: the source directory)
+        depths (list): Scramble depths (Default: DEPTHS)
+        count (int): Scrambles per depth (Default: 10)
+        seed (int): Seed of the corpus (Default: SEED)
+        moves (int): Number of moves to apply (Default: 200000)
+
+    Description:
+        Measures the move rate of the coordinate engine and the generated nodes per second of
+        IDA_star searching on coordinates with the pattern databases (see coordinates.py).
+        Skipped if the coordinate tables or the pattern databases are missing.
+
+    Output:
+        Dictionary of metrics.
+    """
+    try:
+        engine = CoordinateEngine(directory, build = False)
+        heuristic = CoordinateHeuristic(load_pattern_dbs(directory, build = False), engine)
+    except (FileNotFoundError, ValueError):
+        return {}
+    table = list(engine.moves.values())
+    state = engine.solved
+    start = time.perf_counter()
+    for i in range(moves):
+        state = table[i % len(table)](state)
+    results = {'moves.coordinates': _metric(moves / (time.perf_counter() - start), 'moves/s', 'higher')}
+
+    nodes, total = 0, 0
+    for depth in depths:
+        for state in scramble_corpus(depth, count, seed):
+            solver = IDA_star(heuristic)
+            start = time.perf_counter()
+            solver.run(state)
+            total += time.perf_counter() - start
+            nodes += solver.nodes
+    results['solve.coordinates.nodes_per_second'] = _metric(nodes / total if total else 0, 'nodes/s', 'higher')
+    return results
+
+def _peak_rss():
+    # VmHWM starts over with the new process image, ru_maxrss keeps the peak of the forked parent
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+def _build_worker(depth, queue):
+    cube = RubiksCube(n=3)
+    start = time.perf_counter()
+    h = build_heuristic_db(cube.stringify(), move_actions(3), max_moves = depth, canonical = True)
+    queue.put((time.perf_counter() - start, _peak_rss(), len(h)))
+
+def bench_db_build(depths = DB_DEPTHS):
+    """
+    Input:
+        depths (list): Depths of the heuristic databases (Default: DB_DEPTHS)
+
+    Description:
+        Builds the canonical heuristic map of every depth in a fresh process
+        and measures the build time and the peak RSS of that process.
+        A depth whose process dies without a result is reported and skipped.
+
+    Output:
+        Dictionary of metrics.
+    """
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for depth in depths:
+        channel = context.Queue()
+        process = context.Process(target=_build_worker, args=(depth, channel))
+        process.start()
+        result = None
+        while result is None:
+            try:
+                result = channel.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+        process.join()
+        if result is None:
+            print(f'ERROR - the build of depth {depth} stopped without a result (exit code {process.exitcode})', file=sys.stderr)
+            continue
+        elapsed, rss, states = result
+        results[f'db_build.depth{depth}.time'] = _metric(elapsed, 's', 'lower')
+        results[f'db_build.depth{depth}.states'] = _metric(states, 'states', 'equal')
+        if rss is not None:
+            results[f'db_build.depth{depth}.peak_rss'] = _metric(rss, 'MB', 'lower')
+    return results
+
+def bench_db_load(directory = DATA_DIR):
+    """
+    Input:
+        directory (str): Directory of the database files (Default: the source directory)
+
+    Description:
+        Measures how long opening the existing databases takes (missing ones are skipped).
+
+    Output:
+        Dictionary of metrics.
+    """
+    results = {}
+    loaders = {
+        'db_load.heuristic': lambda: HeuristicDB(os.path.join(directory, 'heuristic.db')).get(b'\x00' * 54),
+        'db_load.pattern': lambda: load_pattern_dbs(directory, build = False),
+        'db_load.two_phase': lambda: load_two_phase_tables(directory, build = False)
+    }
+    for name, load in loaders.items():
+        start = time.perf_counter()
+        try:
+            load()
+        except (FileNotFoundError, ValueError):
+            continue
+        results[name] = _metric((time.perf_counter() - start) * 1e3, 'ms', 'lower')
+    return results
+
+def run_benchmarks(depths = DEPTHS, count = 10, db_depths = DB_DEPTHS, seed = SEED, directory = DATA_DIR):
+    """
+    Input:
+        depths (list): Scramble depths of the solver benchmark (Default: DEPTHS)
+        count (int): Scrambles per depth (Default: 10)
+        db_depths (list): Depths of the database build benchmark (Default: DB_DEPTHS)
+        seed (int): Seed of the corpus (Default: SEED)
+        directory (str): Directory of the database files (Default: the source directory)
+
+    Description:
+        Runs every benchmark.
+
+    Output:
+        Dictionary with the run parameters ('meta') and all metrics ('metrics').
+    """
+    metrics = {}
+    metrics.update(bench_moves())
+    metrics.update(bench_sizes())
+    metrics.update(bench_stringify())
+    metrics.update(bench_state_keys())
+    metrics.update(bench_db_load(directory))
+    heuristic = load_heuristic(directory)
+    metrics.update(bench_sampling(heuristic, seed = seed))
+    metrics.update(bench_solver(heuristic, depths, count, seed))
+    metrics.update(bench_optimality(seed = seed))
+    metrics.update(bench_coordinates(directory, depths, count, seed))
+    metrics.update(bench_db_build(db_depths))
+    try:
+        metrics.update(bench_reduction(load_two_phase_tables(directory, build = False), seed = seed))
+    except (FileNotFoundError, ValueError):
+        pass
+    meta = {
+        'seed': seed, 'depths': depths, 'count': count, 'db_depths': db_depths,
+        'python': platform.python_version(), 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    return {'meta': meta, 'metrics': metrics}
+
+def compare_results(baseline, current, threshold = THRESHOLD):
+    """
+    Input:
+        baseline (dict): Results of run_benchmarks
+        current (dict): Results of run_benchmarks
+        threshold (float): Relative change that counts as a regression (Default: 0.1)
+
+    Description:
+        Compares every metric that both results have.
+
+    Output:
+        List of (name, baseline value, current value, relative change, regression) tuples,
+        a positive change is an improvement. Any change of an "equal" metric is a regression.
+    """
+    rows = []
+    for name, old in baseline['metrics'].items():
+        new = current['metrics'].get(name)
+        if new is None:
+            continue
+        if old['better'] == 'equal':
+            change = (new['value'] - old['value']) / old['value'] if old['value'] else float(new['value'] != old['value'])
+            rows.append((name, old['value'], new['value'], change, new['value'] != old['value']))
+            continue
+        if not old['value']:
+            continue
+        change = (new['value'] - old['value']) / old['value']
+        if old['better'] == 'lower':
+            change = -change
+        rows.append((name, old['value'], new['value'], change, change < -threshold))
+    return rows
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark the move engine, the solver and the heuristic databases.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run the benchmarks and write the results')
+    run.add_argument('-o', '--output', default='benchmark.json', help='JSON result file (default: benchmark.json)')
+    run.add_argument('--depths', type=int, nargs='+', default=DEPTHS, help=f'scramble depths (default: {DEPTHS})')
+    run.add_argument('--count', type=int, default=10, help='scrambles per depth (default: 10)')
+    run.add_argument('--db-depths', type=int, nargs='*', default=DB_DEPTHS, help=f'database build depths (default: {DB_DEPTHS})')
+    run.add_argument('--seed', type=int, default=SEED, help=f'corpus seed (default: {SEED})')
+    run.add_argument('--data-dir', default=DATA_DIR, help='directory of the heuristic and pattern databases')
+    compare = commands.add_parser('compare', help='compare results against a baseline')
+    compare.add_argument('baseline', help='JSON result file of the baseline')
+    compare.add_argument('current', help='JSON result file to check')
+    compare.add_argument('--threshold', type=float, default=THRESHOLD, help=f'relative change counted as regression (default: {THRESHOLD})')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.depths, args.count, args.db_depths, args.seed, args.data_dir)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        for name, m in results['metrics'].items():
+            print(f'{name:32} {m["value"]:14.3f} {m["unit"]}')
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = 0
+    for name, old, new, change, regression in compare_results(baseline, current, args.threshold):
+        regressions += regression
+        print(f'{name:32} {old:14.3f} {new:14.3f} {change:+8.1%}{"  REGRESSION" if regression else ""}')
+    if regressions:
+        print(f'ERROR - {regressions} regression(s) above {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
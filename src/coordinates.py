@@ -0,0 +1,347 @@
+import os
+import struct
+from array import array
+from functools import lru_cache
+from operator import itemgetter
+
+from cube import (cube_symmetries, decode_state, encode_state, move_actions, move_table, solved_state,
+                  transform_permutation)
+from cubie import (CENTERS, cubie_moves, cubies_to_facelets, facelets_to_cubies, rank_orientation, rank_partial,
+                   rank_permutation, unrank_orientation, unrank_partial, unrank_permutation)
+from database import moves_crc
+
+#############################################
+#######   Coordinate State Engine   #########
+#############################################
+# A 3x3 state as four small integers instead of 54 facelets:
+#   corners     rank of the corner permutation                                   8! values
+#   twist       the twists of the first 7 corners in base 3                     3^7 values
+#   edges_a     rank of the positions of the edges 0-5 << 6 | their flips       12! / 6! * 2^6 values
+#   edges_b     the same for the edges 6-11
+# These are the indices of the pattern databases (see pattern_db.pattern_index), so a search
+# on coordinates looks up its estimates without converting the state. Every move of the
+# 18 actions is one lookup per coordinate in the move tables (coordinate * 18 + move).
+# The coordinates describe the center-normalized state (see cubie.normalize), a fifth number, the frame,
+# tells which of the 24 whole cube rotations turns it into the facelet state. Middle slice moves
+# turn the frame, and a move in a turned frame turns another face of the normalized state,
+# so the moves mean the same as on facelets and a solution found on coordinates solves the facelet state.
+# In the search a state is packed into 13 bytes (PACKED, the frame last), so it can be a dictionary key
+# like a flat state.
+#
+# File layout: header (MAGIC, version, move set crc32), then the tables in TABLES order.
+
+MAGIC = b'RCCRD\x00\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sBxxxI')
+PACKED = struct.Struct('<HHIIB')
+
+# The edges of edges_a and edges_b, the cubies of the edge pattern databases
+EDGE_GROUPS = [(0, 1, 2, 3, 4, 5), (6, 7, 8, 9, 10, 11)]
+N_CORNERS, N_TWIST, N_EDGES = 40320, 3 ** 7, 665280
+
+# name, typecode, entries
+TABLES = [
+    ('corners_move', 'H', N_CORNERS * 18),
+    ('twist_move', 'H', N_TWIST * 18),
+    ('edges_move', 'I', N_EDGES * 18),
+    ('flips_move', 'B', N_EDGES * 18)
+]
+
+@lru_cache(maxsize=None)
+def frames():
+    """
+    Input:
+        None
+
+    Description:
+        Lists the 24 whole cube rotations as gathers (see cube.move_table) and maps the
+        center colors of every rotated state to the index of its rotation.
+
+    Output:
+        Tuple (list of gathers, dictionary of center colors -> frame).
+    """
+    solved, centers = solved_state(3), itemgetter(*CENTERS)
+    rotations, index = [], {}
+    for k, matrix in enumerate(cube_symmetries()):
+        rotations.append(itemgetter(*transform_permutation(3, matrix)))
+        index[centers(bytes(rotations[k](solved)))] = k
+    return rotations, index
+
+def frame_of(state):
+    """
+    Input:
+        state (bytes): A flat 3x3 state (color i belongs on face i)
+
+    Description:
+        Finds the rotation of the normalized state that gives the state (see frames).
+        Raises a ValueError if the centers do not belong to a valid cube.
+
+    Output:
+        The frame (int between 0 and 23).
+    """
+    frame = frames()[1].get(itemgetter(*CENTERS)(state))
+    if frame is None:
+        raise ValueError('the centers of the state do not belong to a valid cube')
+    return frame
+
+@lru_cache(maxsize=None)
+def frame_moves():
+    """
+    Input:
+        None
+
+    Description:
+        Computes for every frame and action which action of the normalized state it is
+        and the frame after it: the action is applied to the turned solved cube, its frame
+        is read from the centers and its cubie effect from the normalized result.
+
+    Output:
+        Tuple (turns, next frames) of lists with entry frame * 18 + action index.
+    """
+    rotations, _ = frames()
+    actions = move_actions(3)
+    effects = [cubie_moves()[a] for a in actions]
+    turns, following = [], []
+    for rotation in rotations:
+        turned = bytes(rotation(solved_state(3)))
+        for a in actions:
+            state = bytes(move_table(3)[a](turned))
+            turns.append(effects.index(facelets_to_cubies(state)))
+            following.append(frame_of(state))
+    return turns, following
+
+def to_coordinates(state):
+    """
+    Input:
+        state (bytes): A flat 3x3 state (color i belongs on face i)
+
+    Description:
+        Converts the facelet state into its coordinates.
+        Raises a ValueError if the facelets do not form valid cubies.
+
+    Output:
+        Tuple (corners, twist, edges_a, edges_b).
+    """
+    cp, co, ep, eo = facelets_to_cubies(state)
+    edges = []
+    for group in EDGE_GROUPS:
+        positions = [ep.index(e) for e in group]
+        edges.append((rank_partial(positions, 12) << 6) | rank_orientation([eo[p] for p in positions], 2))
+    return (rank_permutation(cp), rank_orientation(co[:7], 3), *edges)
+
+def from_coordinates(coordinates, frame = 0):
+    """
+    Input:
+        coordinates (tuple): (corners, twist, edges_a, edges_b)
+        frame (int): The rotation of the state (see frames) (Default: 0, every center on its own face)
+
+    Description:
+        Converts the coordinates back into a facelet state.
+
+    Output:
+        The flat state (bytes).
+    """
+    corners, twist, *edges = coordinates
+    co = unrank_orientation(twist, 3, 7)
+    ep, eo = [0] * 12, [0] * 12
+    for group, edge in zip(EDGE_GROUPS, edges):
+        for e, p, o in zip(group, unrank_partial(edge >> 6, 12, 6), unrank_orientation(edge & 63, 2, 6)):
+            ep[p], eo[p] = e, o
+    state = cubies_to_facelets(unrank_permutation(corners, 8), co + [-sum(co) % 3], ep, eo)
+    return bytes(frames()[0][frame](state)) if frame else state
+
+def from_string(state, colors = None):
+    """
+    Input:
+        state (str): A string representing the cube (see RubiksCube.stringify)
+        colors (list): The colors in face order (Default: None, taken from the centers)
+
+    Description:
+        Converts the string representation into coordinates. The frame comes last, so a state
+        after a middle slice move or a whole cube rotation converts back unchanged (see to_string).
+
+    Output:
+        Tuple (corners, twist, edges_a, edges_b, frame).
+    """
+    if colors is None:
+        colors = [state[f * 9 + 4] for f in range(6)]
+    flat = encode_state(state, colors)[0]
+    return (*to_coordinates(flat), frame_of(flat))
+
+def to_string(coordinates, colors):
+    """
+    Input:
+        coordinates (tuple): (corners, twist, edges_a, edges_b, frame) as returned by from_string,
+                             without the frame every center is on its own face
+        colors (list): The colors in face order
+
+    Description:
+        Converts the coordinates into the string representation (see RubiksCube.stringify).
+
+    Output:
+        A string representing the cube.
+    """
+    return decode_state(from_coordinates(coordinates[:4], *coordinates[4:]), colors)
+
+def build_coordinate_tables(path):
+    """
+    Input:
+        path (str): Path of the table file
+
+    Description:
+        Computes the move tables of all coordinates for the 18 actions and writes them to the file.
+        The edge tables take about a minute.
+
+    Output:
+        None
+    """
+    moves = [cubie_moves()[a] for a in move_actions(3)]
+    tables = {}
+
+    corners_move = array('H', bytes(2 * N_CORNERS * 18))
+    for r in range(N_CORNERS):
+        cp = unrank_permutation(r, 8)
+        for m, (move_cp, _, _, _) in enumerate(moves):
+            corners_move[r * 18 + m] = rank_permutation([cp[i] for i in move_cp])
+    tables['corners_move'] = corners_move
+
+    twist_move = array('H', bytes(2 * N_TWIST * 18))
+    for r in range(N_TWIST):
+        co = unrank_orientation(r, 3, 7)
+        co.append(-sum(co) % 3)
+        for m, (move_cp, move_co, _, _) in enumerate(moves):
+            twist_move[r * 18 + m] = rank_orientation([(co[move_cp[i]] + move_co[i]) % 3 for i in range(7)], 3)
+    tables['twist_move'] = twist_move
+
+    # The edge at position q moves to the position i with move_ep[i] == q, its flip changes by move_eo[i]
+    targets = []
+    for _, _, move_ep, move_eo in moves:
+        target = [0] * 12
+        for i, q in enumerate(move_ep):
+            target[q] = i
+        targets.append((target, move_eo))
+    edges_move = array('I', bytes(4 * N_EDGES * 18))
+    flips_move = array('B', bytes(N_EDGES * 18))
+    for r in range(N_EDGES):
+        positions = unrank_partial(r, 12, 6)
+        for m, (target, move_eo) in enumerate(targets):
+            moved = [target[q] for q in positions]
+            edges_move[r * 18 + m] = rank_partial(moved, 12)
+            flips_move[r * 18 + m] = rank_orientation([move_eo[i] for i in moved], 2)
+    tables['edges_move'] = edges_move
+    tables['flips_move'] = flips_move
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, moves_crc(move_actions(3))))
+        for name, _, _ in TABLES:
+            f.write(bytes(tables[name]))
+    os.replace(tmp, path)
+
+def load_coordinate_tables(directory, build = True):
+    """
+    Input:
+        directory (str): Directory of the table file (coordinates.tables)
+        build (bool): Build a missing or mismatched table file (Default: True)
+
+    Description:
+        Reads the move tables of the coordinates, building them first if needed.
+
+    Output:
+        Dictionary mapping the table names (see TABLES) to arrays.
+    """
+    path = os.path.join(directory, 'coordinates.tables')
+    size = HEADER.size + sum(array(t).itemsize * n for _, t, n in TABLES)
+    for attempt in range(2):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, crc = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION or crc != moves_crc(move_actions(3)) or len(data) != size:
+                raise ValueError(f'{path} is not a coordinate table file (version {VERSION})')
+            break
+        except (FileNotFoundError, ValueError, struct.error) as e:
+            if not build or attempt:
+                raise
+            if not isinstance(e, FileNotFoundError):
+                print(f'WARNING - {e}, rebuilding the coordinate tables')
+            build_coordinate_tables(path)
+
+    tables, offset = {}, HEADER.size
+    for name, typecode, n in TABLES:
+        table = array(typecode)
+        table.frombytes(data[offset:offset + table.itemsize * n])
+        tables[name] = table
+        offset += table.itemsize * n
+    return tables
+
+class CoordinateEngine(object):
+    def __init__(self, directory, build = True):
+        """
+        Input:
+            directory (str): Directory of the table file (see load_coordinate_tables)
+            build (bool): Build a missing or mismatched table file (Default: True)
+
+        Description:
+            Moves packed coordinate states (see PACKED) with the move tables. self.moves maps
+            every action to its move function, self.solved is the packed solved state,
+            and self.is_solved(state) checks a packed state in any frame.
+            IDA_star searches on coordinates when it gets an engine (see pattern_db.CoordinateHeuristic).
+
+        Output:
+            None
+        """
+        self.directory = directory
+        self.tables = load_coordinate_tables(directory, build = build)
+        self.moves = {a: self._move(i) for i, a in enumerate(move_actions(3))}
+        self.solved = PACKED.pack(*to_coordinates(solved_state(3)), 0)
+        # The frame is the last byte
+        self.is_solved = lambda state, prefix = self.solved[:-1]: state.startswith(prefix)
+
+    def __reduce__(self):
+        # Worker processes read the table file again
+        return CoordinateEngine, (self.directory, False)
+
+    def _move(self, i):
+        corners_move, twist_move = self.tables['corners_move'], self.tables['twist_move']
+        edges_move, flips_move = self.tables['edges_move'], self.tables['flips_move']
+        turns, following = frame_moves()
+        unpack, pack = PACKED.unpack, PACKED.pack
+
+        def move(state):
+            c, t, a, b, f = unpack(state)
+            # The action turns another face of the normalized state in a turned frame
+            m = turns[f * 18 + i]
+            a_move, b_move = (a >> 6) * 18 + m, (b >> 6) * 18 + m
+            return pack(corners_move[c * 18 + m], twist_move[t * 18 + m],
+                        (edges_move[a_move] << 6) | ((a & 63) ^ flips_move[a_move]),
+                        (edges_move[b_move] << 6) | ((b & 63) ^ flips_move[b_move]), following[f * 18 + i])
+        return move
+
+    def encode(self, state, colors = None):
+        """
+        Input:
+            state (str): A string representing the cube (see RubiksCube.stringify)
+            colors (list): The colors in face order (Default: None, taken from the centers)
+
+        Description:
+            Converts the string representation into a packed coordinate state.
+
+        Output:
+            The packed state (bytes).
+        """
+        return PACKED.pack(*from_string(state, colors))
+
+    def decode(self, state, colors):
+        """
+        Input:
+            state (bytes): A packed coordinate state
+            colors (list): The colors in face order
+
+        Description:
+            Converts a packed coordinate state into the string representation.
+
+        Output:
+            A string representing the cube.
+        """
+        return to_string(PACKED.unpack(state), colors)
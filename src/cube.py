@@ -1,4 +1,389 @@
-from random import randint, choice
+from functools import lru_cache
+from itertools import permutations
+from operator import itemgetter
+from random import Random, randint, choice
+
+#############################################
+#########   Flat Facelet Engine   ###########
+#############################################
+# A cube state is a bytes object of 6*n*n color indices (face by face, row by row),
+# exactly the order used by RubiksCube.stringify(). Every move is a precomputed index
+# permutation, so twisting a state is a single gather: bytes(getter(state)).
+
+def move_actions(n = 3):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Lists every move of an n x n cube as (type, layer, direction) tuples,
+        in the same order the solver and the heuristic database use.
+
+    Output:
+        List of move tuples.
+    """
+    return [(r, i, d) for r in ['h', 'v', 's'] for d in [0, 1] for i in range(n)]
+
+@lru_cache(maxsize=None)
+def move_permutation(n, action):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube
+        action (tuple): A move tuple like ('h', 0, 1)
+
+    Description:
+        Applies the move to a cube labelled with its own facelet indices.
+        The result tells for every facelet which old facelet ends up there.
+
+    Output:
+        Tuple of 6*n*n facelet indices (new_state[i] = old_state[perm[i]]).
+    """
+    cube = [[[f * n * n + r * n + c for c in range(n)] for r in range(n)] for f in range(6)]
+    _LIST_TWISTS[action[0]](cube, action[1], action[2])
+    return tuple(i for side in cube for row in side for i in row)
+
+@lru_cache(maxsize=None)
+def move_table(n = 3):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Builds one gather function per move. Calling it on a state returns the
+        permuted facelets as a tuple, which bytes() turns into the new state.
+
+    Output:
+        Dictionary mapping every move tuple to its itemgetter.
+    """
+    return {a: itemgetter(*move_permutation(n, a)) for a in move_actions(n)}
+
+# Outward normal of every face, in face order (up, left, front, right, back, down)
+FACE_NORMALS = [(0, 1, 0), (-1, 0, 0), (0, 0, 1), (1, 0, 0), (0, 0, -1), (0, -1, 0)]
+
+@lru_cache(maxsize=None)
+def facelet_coordinates(n = 3):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Computes the 3D position of every facelet in the flat state order.
+        Coordinates are doubled so they stay integers: the face planes lie at +-n
+        and the facelet centers at 2*i - (n - 1). x points right, y up and z to the front.
+
+    Output:
+        List of 6*n*n (x, y, z) tuples.
+    """
+    coords = []
+    for f in range(6):
+        for r in range(n):
+            for c in range(n):
+                u, v = 2 * c - (n - 1), 2 * r - (n - 1)
+                coords.append([(u, n, v), (-n, -v, u), (u, -v, n), (n, -v, -u), (-u, -v, -n), (u, -n, -v)][f])
+    return coords
+
+@lru_cache(maxsize=None)
+def transform_permutation(n, matrix):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube
+        matrix (tuple): A 3x3 signed permutation matrix as a tuple of rows
+
+    Description:
+        Turns a rotation (or reflection) of the whole cube into a facelet permutation.
+
+    Output:
+        Tuple of 6*n*n facelet indices (new_state[i] = old_state[perm[i]]).
+    """
+    coords = facelet_coordinates(n)
+    index = {p: i for i, p in enumerate(coords)}
+    perm = [0] * len(coords)
+    for j, p in enumerate(coords):
+        perm[index[tuple(sum(row[k] * p[k] for k in range(3)) for row in matrix)]] = j
+    return tuple(perm)
+
+@lru_cache(maxsize=None)
+def cube_symmetries(reflections = False):
+    """
+    Input:
+        reflections (bool): Include the 24 mirrored symmetries (Default: False)
+
+    Description:
+        Lists the signed permutation matrices of the whole cube rotations
+        (and reflections after them), starting with the identity.
+
+    Output:
+        List of 24 (or 48) matrices as tuples of rows.
+    """
+    matrices = []
+    for axes in [(0, 1, 2), (0, 2, 1), (1, 0, 2), (1, 2, 0), (2, 0, 1), (2, 1, 0)]:
+        for signs in [(a, b, c) for a in (1, -1) for b in (1, -1) for c in (1, -1)]:
+            matrices.append(tuple(tuple(signs[r] if k == axes[r] else 0 for k in range(3)) for r in range(3)))
+    matrices.sort(key = lambda m: -_determinant(m))
+    return [m for m in matrices if reflections or _determinant(m) == 1]
+
+def _determinant(m):
+    return (m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1])
+          - m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0])
+          + m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0]))
+
+# Number of leading facelets compared before whole symmetric copies are built (see canonical_state)
+CANONICAL_PREFIX = 3
+
+@lru_cache(maxsize=None)
+def _canonical_tables(n):
+    """
+    Precomputes the gathers of canonical_state: the recoloring that brings the centers home,
+    the recoloring of every symmetry, and gathers into the 48 recolored copies stacked after each other.
+    """
+    n2, size = n * n, 6 * n * n
+    symmetries = [transform_permutation(n, m) for m in cube_symmetries(reflections=True)]
+    home = {c: bytes.maketrans(bytes(c), bytes(range(6))) for c in permutations(range(6))}
+    recolor = [bytes.maketrans(bytes(p[f * n2 + n2 // 2] // n2 for f in range(6)), bytes(range(6))) for p in symmetries]
+    prefix = itemgetter(*[k * size + i for k, p in enumerate(symmetries) for i in p[:CANONICAL_PREFIX]])
+    copies = [itemgetter(*[k * size + i for i in p]) for k, p in enumerate(symmetries)]
+    return itemgetter(*[f * n2 + n2 // 2 for f in range(6)]), home, recolor, prefix, copies
+
+def canonical_state(state, n = 3):
+    """
+    Input:
+        state (bytes): A flat cube state
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Maps the state to the representative of its class under the 48 whole cube rotations
+        and reflections combined with relabeling the colors: every symmetric copy is recolored
+        so its centers show the colors 0-5 in face order (for even n the colors are taken in
+        order of first appearance) and the smallest copy is the representative.
+        Mirrored and rotated moves are moves as well and is_solved ignores the colors,
+        so all states of a class have the same distance to solved.
+        For odd n only the first CANONICAL_PREFIX facelets of every copy are gathered,
+        the full copies are only built for the smallest prefixes.
+
+    Output:
+        The canonical flat state (bytes).
+    """
+    if n % 2 == 0:
+        best = None
+        for matrix in cube_symmetries(reflections=True):
+            turned = bytes(state[i] for i in transform_permutation(n, matrix))
+            turned = turned.translate(bytes.maketrans(bytes(dict.fromkeys(turned)), bytes(range(6))))
+            if best is None or turned < best:
+                best = turned
+        return best
+
+    centers, home, recolor, prefix, copies = _canonical_tables(n)
+    state = state.translate(home[centers(state)])
+    stacked = b''.join([state.translate(t) for t in recolor])
+    prefixes = bytes(prefix(stacked))
+    k = CANONICAL_PREFIX
+    best = min(prefixes[i:i + k] for i in range(0, len(prefixes), k))
+    candidates = []
+    i = prefixes.find(best)
+    while i != -1:
+        if i % k == 0:
+            candidates.append(bytes(copies[i // k](stacked)))
+        i = prefixes.find(best, i + 1)
+    return min(candidates)
+
+def recolor_state(state, n = 3):
+    """
+    Input:
+        state (bytes): A flat cube state
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Relabels the colors so the centers show the colors 0-5 in face order (for even n
+        the colors are taken in order of first appearance). Moves commute with relabeling,
+        and every solved cube relabels to the same state whichever way it is turned, so a table
+        keyed by relabeled states holds the distances to any solved cube (see is_solved).
+
+    Output:
+        The relabeled flat state (bytes).
+    """
+    if n % 2 == 0:
+        return state.translate(bytes.maketrans(bytes(dict.fromkeys(state)), bytes(range(6))))
+    centers, home = _canonical_tables(n)[:2]
+    return state.translate(home[centers(state)])
+
+def symmetric_states(state, n = 3):
+    """
+    Input:
+        state (bytes): A flat cube state
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Builds the 48 symmetric copies of the state, recolored like in canonical_state.
+        They are the states of its class, a state with a symmetry appears more than once.
+
+    Output:
+        List of 48 flat states (bytes).
+    """
+    if n % 2 == 0:
+        copies = []
+        for matrix in cube_symmetries(reflections=True):
+            turned = bytes(state[i] for i in transform_permutation(n, matrix))
+            copies.append(turned.translate(bytes.maketrans(bytes(dict.fromkeys(turned)), bytes(range(6)))))
+        return copies
+
+    centers, home, recolor, prefix, copies = _canonical_tables(n)
+    state = state.translate(home[centers(state)])
+    stacked = b''.join([state.translate(t) for t in recolor])
+    return [bytes(copy(stacked)) for copy in copies]
+
+def solved_state(n = 3):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Creates the flat state of a solved cube (face i has color index i).
+
+    Output:
+        bytes object of length 6*n*n.
+    """
+    return bytes(f for f in range(6) for _ in range(n * n))
+
+def is_solved(state, n = 3):
+    """
+    Input:
+        state (bytes): A flat cube state
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Checks if every face of the flat state shows only one color.
+
+    Output:
+        A boolean value, True if the cube is solved, False otherwise.
+    """
+    n2 = n * n
+    for i in range(0, 6 * n2, n2):
+        if state.count(state[i], i, i + n2) != n2:
+            return False
+    return True
+
+# Seed of the Zobrist keys, fixed so hashes agree between processes and runs
+ZOBRIST_SEED = 0x2B1C
+
+@lru_cache(maxsize=None)
+def zobrist_keys(n = 3):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Draws one random 64-bit key per facelet and color, from ZOBRIST_SEED.
+
+    Output:
+        List of 6*n*n*6 keys, the key of color c at facelet i is at 6*i + c.
+    """
+    rng = Random(ZOBRIST_SEED + n)
+    return [rng.getrandbits(64) for _ in range(36 * n * n)]
+
+def encode_state(state, colors = None):
+    """
+    Input:
+        state (str): A string representing the cube (see RubiksCube.stringify)
+        colors (list): The colors in index order. (Default: None, colors are taken in order of appearance)
+
+    Description:
+        Converts the string representation into the flat bytes representation.
+
+    Output:
+        Tuple (flat state (bytes), colors (list)).
+    """
+    if colors is None:
+        colors = list(dict.fromkeys(state))
+    table = bytearray(range(256))
+    for i, c in enumerate(colors):
+        table[ord(c)] = i
+    return state.encode('ascii').translate(table), colors
+
+def decode_state(state, colors):
+    """
+    Input:
+        state (bytes): A flat cube state
+        colors (list): The colors in index order
+
+    Description:
+        Converts the flat bytes representation back into the string representation.
+
+    Output:
+        A string representing the cube (see RubiksCube.stringify).
+    """
+    return state.translate(_decode_table(tuple(colors))).decode('ascii')
+
+@lru_cache(maxsize=None)
+def _decode_table(colors):
+    table = bytearray(range(256))
+    for i, c in enumerate(colors):
+        table[i] = ord(c)
+    return bytes(table)
+
+def _horizontal_list_twist(cube, row, direction):
+    n = len(cube[0])
+    if direction == 0:
+        cube[1][row], cube[2][row], cube[3][row], cube[4][row] = cube[2][row], cube[3][row], cube[4][row], cube[1][row]
+        if row == 0:
+            cube[0] = [list(x) for x in zip(*reversed(cube[0]))] #Transpose top
+        elif row == n - 1:
+            cube[5] = [list(x) for x in zip(*cube[5])][::-1] #Transpose bottom
+    else:
+        cube[1][row], cube[2][row], cube[3][row], cube[4][row] = cube[4][row], cube[1][row], cube[2][row], cube[3][row]
+        if row == 0:
+            cube[0] = [list(x) for x in zip(*cube[0])][::-1] #Transpose top
+        elif row == n - 1:
+            cube[5] = [list(x) for x in zip(*reversed(cube[5]))] #Transpose bottom
+
+def _vertical_list_twist(cube, column, direction):
+    n = len(cube[0])
+    for i in range(n):
+        if direction == 0:
+            cube[0][i][column], cube[2][i][column], cube[4][-i-1][-column-1], cube[5][i][column] = (cube[4][-i-1][-column-1],
+                                                                                                    cube[0][i][column],
+                                                                                                    cube[5][i][column],
+                                                                                                    cube[2][i][column])
+        else:
+            cube[0][i][column], cube[2][i][column], cube[4][-i-1][-column-1], cube[5][i][column] = (cube[2][i][column],
+                                                                                                    cube[5][i][column],
+                                                                                                    cube[0][i][column],
+                                                                                                    cube[4][-i-1][-column-1])
+    if direction == 0:
+        if column == 0:
+            cube[1] = [list(x) for x in zip(*reversed(cube[1]))] #Transpose left
+        elif column == n - 1:
+            cube[3] = [list(x) for x in zip(*cube[3])][::-1] #Transpose right
+    else:
+        if column == 0:
+            cube[1] = [list(x) for x in zip(*cube[1])][::-1] #Transpose left
+        elif column == n - 1:
+            cube[3] = [list(x) for x in zip(*reversed(cube[3]))] #Transpose right
+
+def _side_list_twist(cube, column, direction):
+    n = len(cube[0])
+    for i in range(n):
+        if direction == 0:
+            cube[0][column][i], cube[1][-i-1][column], cube[3][i][-column-1], cube[5][-column-1][-1-i] = (cube[3][i][-column-1],
+                                                                                                          cube[0][column][i],
+                                                                                                          cube[5][-column-1][-1-i],
+                                                                                                          cube[1][-i-1][column])
+        else:
+            cube[0][column][i], cube[1][-i-1][column], cube[3][i][-column-1], cube[5][-column-1][-1-i] = (cube[1][-i-1][column],
+                                                                                                          cube[5][-column-1][-1-i],
+                                                                                                          cube[0][column][i],
+                                                                                                          cube[3][i][-column-1])
+    if direction == 0:
+        if column == 0:
+            cube[4] = [list(x) for x in zip(*reversed(cube[4]))] #Transpose back
+        elif column == n - 1:
+            cube[2] = [list(x) for x in zip(*cube[2])][::-1] #Transpose front
+    else:
+        if column == 0:
+            cube[4] = [list(x) for x in zip(*cube[4])][::-1] #Transpose back
+        elif column == n - 1:
+            cube[2] = [list(x) for x in zip(*reversed(cube[2]))] #Transpose front
+
+_LIST_TWISTS = {'h': _horizontal_list_twist, 'v': _vertical_list_twist, 's': _side_list_twist}
 
 class RubiksCube:
 
@@ -13,25 +398,28 @@ class RubiksCube:
             Initializes the Rubik's cube object with the specified dimensions, colors, and state.
             If state is None, a new Rubik's cube is created and initialized to the solved state.
             If state is not None, the Rubik's cube is created and initialized to the specified state.
+            Internally the cube is stored as a flat state (see encode_state), the nested
+            list view is available through the cube attribute.
 
         Output:
             None
         """
         if state is None:
             self.n = n
-            self.colors = colors
+            self.colors = list(colors)
             self.reset()
         else:
             self.n = int((len(state) / 6) ** (.5))
-            self.colors = []
-            self.cube = [[[]]]
-            for i, s in enumerate(state):
-                if s not in self.colors: self.colors.append(s)
-                self.cube[-1][-1].append(s)
-                if len(self.cube[-1][-1]) == self.n and len(self.cube[-1]) < self.n:
-                    self.cube[-1].append([])
-                elif len(self.cube[-1][-1]) == self.n and len(self.cube[-1]) == self.n and i < len(state) - 1:
-                    self.cube.append([[]])
+            self.state, self.colors = encode_state(state)
+
+    @property
+    def cube(self):
+        """
+        Nested list view (side -> row -> color) of the flat state.
+        """
+        n = self.n
+        s = self.stringify()
+        return [[list(s[f * n * n + r * n:f * n * n + (r + 1) * n]) for r in range(n)] for f in range(6)]
 
     def reset(self):
         """
@@ -44,7 +432,7 @@ class RubiksCube:
         Output: 
             None
         """
-        self.cube = [[[c for x in range(self.n)] for y in range(self.n)] for c in self.colors]
+        self.state = solved_state(self.n)
 
     def solved(self):
         """
@@ -57,17 +445,7 @@ class RubiksCube:
         Output: 
             A boolean value, True if the cube is solved, False otherwise.
         """
-        for side in self.cube:
-            hold = []
-            for row in side:
-                if len(set(row)) == 1:
-                    hold.append(row[0])
-                else:
-                    return False
-            if len(set(hold)) > 1:
-                return False
-
-        return True
+        return is_solved(self.state, self.n)
 
     def stringify(self):
         """
@@ -80,7 +458,20 @@ class RubiksCube:
         Output: 
             A string representing the Rubik's cube in its current state.
         """
-        return ''.join([i for r in self.cube for s in r for i in s])
+        return decode_state(self.state, self.colors)
+
+    def twist(self, action):
+        """
+        Input:
+            action (tuple): A move tuple like ('h', 0, 1)
+
+        Description:
+            Applies the move through its precomputed permutation.
+
+        Output:
+            None
+        """
+        self.state = bytes(move_table(self.n)[action](self.state))
 
     def shuffle(self, l_rot = 5, u_rot = 100):
         """
@@ -123,10 +514,11 @@ class RubiksCube:
         Description: Show the rubiks cube in terminal
         Output: None
         """
-        spacing = f'{" " * (len(str(self.cube[0][0])) + 2)}'
-        l1 = '\n'.join(spacing + str(c) for c in self.cube[0])
-        l2 = '\n'.join('  '.join(str(self.cube[i][j]) for i in range(1,5)) for j in range(len(self.cube[0])))
-        l3 = '\n'.join(spacing + str(c) for c in self.cube[5])
+        cube = self.cube
+        spacing = f'{" " * (len(str(cube[0][0])) + 2)}'
+        l1 = '\n'.join(spacing + str(c) for c in cube[0])
+        l2 = '\n'.join('  '.join(str(cube[i][j]) for i in range(1,5)) for j in range(len(cube[0])))
+        l3 = '\n'.join(spacing + str(c) for c in cube[5])
         print(f'{l1}\n\n{l2}\n\n{l3}')
 
     def horizontal_twist(self, row, direction):
@@ -141,34 +533,13 @@ class RubiksCube:
         Output: 
             None
         """
-        if row < len(self.cube[0]):
-            if direction == 0:
-                self.cube[1][row], self.cube[2][row], self.cube[3][row], self.cube[4][row] = (self.cube[2][row],
-                                                                                              self.cube[3][row],
-                                                                                              self.cube[4][row],
-                                                                                              self.cube[1][row])
-
-            elif direction == 1:
-                self.cube[1][row], self.cube[2][row], self.cube[3][row], self.cube[4][row] = (self.cube[4][row],
-                                                                                              self.cube[1][row],
-                                                                                              self.cube[2][row],
-                                                                                              self.cube[3][row])
-            else:
+        if row < self.n:
+            if direction not in (0, 1):
                 print(f'ERROR - direction must be 0 or 1. {direction} is not a valid direction')
                 return
-            #Rotating connected face
-            if direction == 0:
-                if row == 0:
-                    self.cube[0] = [list(x) for x in zip(*reversed(self.cube[0]))] #Transpose top
-                elif row == len(self.cube[0]) - 1:
-                    self.cube[5] = [list(x) for x in zip(*reversed(self.cube[5]))] #Transpose bottom
-            elif direction == 1:
-                if row == 0:
-                    self.cube[0] = [list(x) for x in zip(*self.cube[0])][::-1] #Transpose top
-                elif row == len(self.cube[0]) - 1:
-                    self.cube[5] = [list(x) for x in zip(*self.cube[5])][::-1] #Transpose bottom
+            self.twist(('h', row, int(direction)))
         else:
-            print(f'ERROR - row must be between 0 and {len(self.cube[0]) - 1}. {row} is not a valid row')
+            print(f'ERROR - row must be between 0 and {self.n - 1}. {row} is not a valid row')
             return
 
     def vertical_twist(self, column, direction):
@@ -183,34 +554,13 @@ class RubiksCube:
         Output: 
             None
         """
-        if column < len(self.cube[0]):
-            for i in range(len(self.cube[0])):
-                if direction == 0:
-                    self.cube[0][i][column], self.cube[2][i][column], self.cube[4][-i-1][-column-1], self.cube[5][i][column] = (self.cube[4][-i-1][-column-1],
-                                                                                                                                self.cube[0][i][column],
-                                                                                                                                self.cube[5][i][column],
-                                                                                                                                self.cube[2][i][column])
-                elif direction == 1:
-                    self.cube[0][i][column], self.cube[2][i][column], self.cube[4][-i-1][-column-1], self.cube[5][i][column] = (self.cube[2][i][column],
-                                                                                                                                self.cube[5][i][column],
-                                                                                                                                self.cube[0][i][column],
-                                                                                                                                self.cube[4][-i-1][-column-1])
-                else:
-                    print(f'ERROR - direction must be 0 or 1. {direction} is not a valid direction')
-                    return
-            #Rotating connected face
-            if direction == 0: #Twist down
-                if column == 0:
-                    self.cube[1] = [list(x) for x in zip(*self.cube[1])][::-1] #Transpose left
-                elif column == len(self.cube[0]) - 1:
-                    self.cube[3] = [list(x) for x in zip(*self.cube[3])][::-1] #Transpose right
-            elif direction == 1: #Twist up
-                if column == 0:
-                    self.cube[1] = [list(x) for x in zip(*reversed(self.cube[1]))] #Transpose left
-                elif column == len(self.cube[0]) - 1:
-                    self.cube[3] = [list(x) for x in zip(*reversed(self.cube[3]))] #Transpose right
+        if column < self.n:
+            if direction not in (0, 1):
+                print(f'ERROR - direction must be 0 or 1. {direction} is not a valid direction')
+                return
+            self.twist(('v', column, int(direction)))
         else:
-            print(f'ERROR - column must be between 0 and {len(self.cube[0]) - 1}. {column} is not a valid column')
+            print(f'ERROR - column must be between 0 and {self.n - 1}. {column} is not a valid column')
             return
 
     def side_twist(self, column, direction):
@@ -225,32 +575,11 @@ class RubiksCube:
         Output: 
             None
         """
-        if column < len(self.cube[0]):
-            for i in range(len(self.cube[0])):
-                if direction == 0:
-                    self.cube[0][column][i], self.cube[1][-i-1][column], self.cube[3][i][-column-1], self.cube[5][-column-1][-1-i] = (self.cube[3][i][-column-1],
-                                                                                                                                      self.cube[0][column][i],
-                                                                                                                                      self.cube[5][-column-1][-1-i],
-                                                                                                                                      self.cube[1][-i-1][column])
-                elif direction == 1:
-                    self.cube[0][column][i], self.cube[1][-i-1][column], self.cube[3][i][-column-1], self.cube[5][-column-1][-1-i] = (self.cube[1][-i-1][column],
-                                                                                                                                      self.cube[5][-column-1][-1-i],
-                                                                                                                                      self.cube[0][column][i],
-                                                                                                                                      self.cube[3][i][-column-1])
-                else:
-                    print(f'ERROR - direction must be 0 or 1. {direction} is not a valid direction')
-                    return
-            #Rotating connected face
-            if direction == 0:
-                if column == 0:
-                    self.cube[4] = [list(x) for x in zip(*reversed(self.cube[4]))] #Transpose back
-                elif column == len(self.cube[0]) - 1:
-                    self.cube[2] = [list(x) for x in zip(*reversed(self.cube[2]))] #Transpose top
-            elif direction == 1:
-                if column == 0:
-                    self.cube[4] = [list(x) for x in zip(*self.cube[4])][::-1] #Transpose back
-                elif column == len(self.cube[0]) - 1:
-                    self.cube[2] = [list(x) for x in zip(*self.cube[2])][::-1] #Transpose top
+        if column < self.n:
+            if direction not in (0, 1):
+                print(f'ERROR - direction must be 0 or 1. {direction} is not a valid direction')
+                return
+            self.twist(('s', column, int(direction)))
         else:
-            print(f'ERROR - side must be between 0 and {len(self.cube[0]) - 1}. {column} is not a valid side')
+            print(f'ERROR - side must be between 0 and {self.n - 1}. {column} is not a valid side')
             return
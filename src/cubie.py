@@ -0,0 +1,314 @@
+from functools import lru_cache
+from math import factorial
+from operator import itemgetter
+
+from cube import (FACE_NORMALS, cube_symmetries, facelet_coordinates, move_permutation, move_table, solved_state,
+                  transform_permutation)
+
+#############################################
+#########   3x3 Cubie Model   ###############
+#############################################
+# A 3x3 state as cubies: cp[i]/ep[i] is the corner/edge that sits at position i and
+# co[i]/eo[i] its twist/flip. Positions and facelet orders follow the usual convention
+# (corner facelets clockwise, starting at the up/down facelet).
+# Middle slice moves turn the centers as well, so facelet states are first rotated
+# as a whole until every center is back on its own face.
+
+FACES = 'ULFRBD'
+CORNERS = ['URF', 'UFL', 'ULB', 'UBR', 'DFR', 'DLF', 'DBL', 'DRB']
+EDGES = ['UR', 'UF', 'UL', 'UB', 'DR', 'DF', 'DL', 'DB', 'FR', 'FL', 'BL', 'BR']
+
+def _facelet(cubie, face):
+    coords = facelet_coordinates(3)
+    normal = FACE_NORMALS[FACES.index(face)]
+    position = [sum(FACE_NORMALS[FACES.index(f)][k] for f in cubie) * 2 for k in range(3)]
+    position = tuple(3 * normal[k] if normal[k] else position[k] for k in range(3))
+    return coords.index(position)
+
+CORNER_FACELETS = [[_facelet(c, f) for f in c] for c in CORNERS]
+EDGE_FACELETS = [[_facelet(e, f) for f in e] for e in EDGES]
+CORNER_COLORS = [[FACES.index(f) for f in c] for c in CORNERS]
+EDGE_COLORS = [[FACES.index(f) for f in e] for e in EDGES]
+CENTERS = [f * 9 + 4 for f in range(6)]
+
+# Colors read at a position -> (cubie, orientation)
+_CORNER_LOOKUP = {tuple(CORNER_COLORS[j][(m - o) % 3] for m in range(3)): (j, o) for j in range(8) for o in range(3)}
+_EDGE_LOOKUP = {tuple(EDGE_COLORS[j][(m - o) % 2] for m in range(2)): (j, o) for j in range(12) for o in range(2)}
+_CORNER_GETTERS = [itemgetter(*f) for f in CORNER_FACELETS]
+_EDGE_GETTERS = [itemgetter(*f) for f in EDGE_FACELETS]
+_CENTER_GETTER = itemgetter(*CENTERS)
+
+@lru_cache(maxsize=None)
+def _orientations():
+    """
+    Maps the center colors of a state to the gather that rotates the whole cube
+    so that every center is back on its own face, and its index list.
+    """
+    solved = solved_state(3)
+    orientations = {}
+    for matrix in cube_symmetries():
+        perm = transform_permutation(3, matrix)
+        turned = bytes(solved[i] for i in perm)
+        inverse = [0] * len(perm)
+        for i, p in enumerate(perm):
+            inverse[p] = i
+        orientations[_CENTER_GETTER(turned)] = itemgetter(*inverse), tuple(inverse)
+    return orientations
+
+def normalize(state):
+    """
+    Input:
+        state (bytes): A flat 3x3 state (color i belongs on face i)
+
+    Description:
+        Rotates the whole cube so that every center is on its own face.
+
+    Output:
+        The rotated flat state (bytes).
+    """
+    turn = _orientations().get(_CENTER_GETTER(state))
+    if turn is None:
+        raise ValueError('the centers of the state do not belong to a valid cube')
+    return bytes(turn[0](state))
+
+def frame_moves(state):
+    """
+    Input:
+        state (bytes): A flat 3x3 state (color i belongs on face i)
+
+    Description:
+        Moves found for the normalized state (see normalize) turn the faces of the rotated cube.
+        Maps every move to the move that does the same on the state itself.
+
+    Output:
+        Dictionary mapping move tuples to move tuples.
+    """
+    turn = _orientations().get(_CENTER_GETTER(state))
+    if turn is None:
+        raise ValueError('the centers of the state do not belong to a valid cube')
+    q = turn[1]
+    actions = {move_permutation(3, a): a for a in move_table(3)}
+    frame = {}
+    for a in move_table(3):
+        p, moved = move_permutation(3, a), [0] * len(q)
+        for i in range(len(q)):
+            moved[q[i]] = q[p[i]]
+        frame[a] = actions[tuple(moved)]
+    return frame
+
+def facelets_to_cubies(state):
+    """
+    Input:
+        state (bytes): A flat 3x3 state (color i belongs on face i)
+
+    Description:
+        Converts the facelet state into the cubie representation.
+        Raises a ValueError if the facelets do not form valid cubies.
+
+    Output:
+        Tuple (cp, co, ep, eo) of lists.
+    """
+    state = normalize(state)
+    try:
+        corners = [_CORNER_LOOKUP[g(state)] for g in _CORNER_GETTERS]
+        edges = [_EDGE_LOOKUP[g(state)] for g in _EDGE_GETTERS]
+    except KeyError as e:
+        raise ValueError(f'invalid cubie colors {e.args[0]}') from None
+    return [c[0] for c in corners], [c[1] for c in corners], [e[0] for e in edges], [e[1] for e in edges]
+
+def cubies_to_facelets(cp, co, ep, eo):
+    """
+    Input:
+        cp (list): corner permutation
+        co (list): corner orientation
+        ep (list): edge permutation
+        eo (list): edge orientation
+
+    Description:
+        Converts the cubie representation into a flat facelet state.
+
+    Output:
+        The flat state (bytes) with every center on its own face.
+    """
+    state = bytearray(solved_state(3))
+    for i, facelets in enumerate(CORNER_FACELETS):
+        for k in range(3):
+            state[facelets[(k + co[i]) % 3]] = CORNER_COLORS[cp[i]][k]
+    for i, facelets in enumerate(EDGE_FACELETS):
+        for k in range(2):
+            state[facelets[(k + eo[i]) % 2]] = EDGE_COLORS[ep[i]][k]
+    return bytes(state)
+
+def multiply(a, b):
+    """
+    Input:
+        a (tuple): cubie state (cp, co, ep, eo)
+        b (tuple): cubie state (cp, co, ep, eo)
+
+    Description:
+        Applies b to a (for example a move to a state).
+
+    Output:
+        The cubie state (cp, co, ep, eo) of the product.
+    """
+    cp = [a[0][b[0][i]] for i in range(8)]
+    co = [(a[1][b[0][i]] + b[1][i]) % 3 for i in range(8)]
+    ep = [a[2][b[2][i]] for i in range(12)]
+    eo = [(a[3][b[2][i]] + b[3][i]) % 2 for i in range(12)]
+    return cp, co, ep, eo
+
+def is_solvable(cp, co, ep, eo):
+    """
+    Input:
+        cp (list): corner permutation
+        co (list): corner orientation
+        ep (list): edge permutation
+        eo (list): edge orientation
+
+    Description:
+        Checks if the cubies can be solved with moves: every cubie is there once,
+        the twists and flips add up to zero and both permutations have the same parity.
+
+    Output:
+        A boolean value.
+    """
+    if sorted(cp) != list(range(8)) or sorted(ep) != list(range(12)):
+        return False
+    return sum(co) % 3 == 0 and sum(eo) % 2 == 0 and _parity(cp) == _parity(ep)
+
+def _parity(perm):
+    return sum(1 for i in range(len(perm)) for j in range(i) if perm[j] > perm[i]) % 2
+
+@lru_cache(maxsize=None)
+def cubie_moves():
+    """
+    Input:
+        None
+
+    Description:
+        Computes the cubie effect of every move of the 3x3 action list.
+        A middle slice move acts like the two outer faces next to it.
+
+    Output:
+        Dictionary mapping every move tuple to its cubie state (cp, co, ep, eo).
+    """
+    solved = solved_state(3)
+    return {a: facelets_to_cubies(bytes(move(solved))) for a, move in move_table(3).items()}
+
+#############################################
+##########   Ranking Functions   ############
+#############################################
+
+def rank_permutation(perm):
+    """
+    Input:
+        perm (list): A permutation of range(len(perm))
+
+    Description:
+        Computes the lexicographic rank (Lehmer code) of the permutation.
+
+    Output:
+        Rank between 0 and len(perm)! - 1.
+    """
+    return rank_partial(perm, len(perm))
+
+def unrank_permutation(rank, n):
+    """
+    Input:
+        rank (int): A rank computed by rank_permutation
+        n (int): The length of the permutation
+
+    Description:
+        Reverses rank_permutation.
+
+    Output:
+        The permutation (list).
+    """
+    return unrank_partial(rank, n, n)
+
+def rank_partial(positions, n):
+    """
+    Input:
+        positions (list): k distinct values of range(n)
+        n (int): The number of available values
+
+    Description:
+        Computes the rank of a partial permutation (an ordered selection of k out of n values).
+
+    Output:
+        Rank between 0 and n! / (n - k)! - 1.
+    """
+    rank, used = 0, 0
+    for i, v in enumerate(positions):
+        rank = rank * (n - i) + v - bin(used & ((1 << v) - 1)).count('1')
+        used |= 1 << v
+    return rank
+
+def unrank_partial(rank, n, k):
+    """
+    Input:
+        rank (int): A rank computed by rank_partial
+        n (int): The number of available values
+        k (int): The number of selected values
+
+    Description:
+        Reverses rank_partial.
+
+    Output:
+        The selection (list of k values).
+    """
+    digits = []
+    for i in range(k - 1, -1, -1):
+        rank, d = divmod(rank, n - i)
+        digits.append(d)
+    free = list(range(n))
+    return [free.pop(d) for d in reversed(digits)]
+
+def partial_count(n, k):
+    """
+    Input:
+        n (int): The number of available values
+        k (int): The number of selected values
+
+    Description:
+        Number of partial permutations of k out of n values.
+
+    Output:
+        n! / (n - k)!
+    """
+    return factorial(n) // factorial(n - k)
+
+def rank_orientation(ori, base):
+    """
+    Input:
+        ori (list): Orientations (digits below base)
+        base (int): 3 for corners, 2 for edges
+
+    Description:
+        Reads the orientations as a number in the given base.
+
+    Output:
+        Rank between 0 and base ** len(ori) - 1.
+    """
+    rank = 0
+    for o in ori:
+        rank = rank * base + o
+    return rank
+
+def unrank_orientation(rank, base, k):
+    """
+    Input:
+        rank (int): A rank computed by rank_orientation
+        base (int): 3 for corners, 2 for edges
+        k (int): The number of orientations
+
+    Description:
+        Reverses rank_orientation.
+
+    Output:
+        The orientations (list of k digits).
+    """
+    ori = [0] * k
+    for i in range(k - 1, -1, -1):
+        rank, ori[i] = divmod(rank, base)
+    return ori
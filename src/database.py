@@ -0,0 +1,419 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from collections.abc import Mapping
+
+from cube import encode_state, move_permutation
+
+#############################################
+#######   Binary Heuristic Database   #######
+#############################################
+# File layout (all integers little endian):
+#   header      MAGIC, version, n, depth, bucket bits, move set crc32, entry count, metadata length
+#   metadata    JSON with the move set, the colors and if the keys are canonical states, padded to 8 bytes
+#   buckets     (2**bucket_bits + 1) uint64 offsets into the sorted entries
+#   keys        count fixed width packed states, sorted by (bucket, key)
+#               the bucket of a key is the top bucket bits of its crc32, so when the file grows
+#               every bucket splits into neighbouring buckets and a new layer is merged in one pass
+#   depths      count uint8 distances
+# A packed state is the flat state read as a base 6 number (see pack_state).
+
+MAGIC = b'RCHDB\x00\x00\x00'
+VERSION = 4
+HEADER = struct.Struct('<8sBBBBIQI')
+_DIGITS = bytes.maketrans(bytes(range(6)), b'012345')
+
+def key_width(n):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube
+
+    Description:
+        Computes the number of bytes needed to store a packed state of an n x n cube.
+
+    Output:
+        Number of bytes (int).
+    """
+    return ((6 ** (6 * n * n) - 1).bit_length() + 7) // 8
+
+def pack_state(state, width):
+    """
+    Input:
+        state (bytes): A flat cube state (color indices 0-5)
+        width (int): The width of the packed key (see key_width)
+
+    Description:
+        Packs the flat state into a fixed width big endian base 6 number,
+        so packed keys compare in the same order as the states.
+
+    Output:
+        bytes object of length width.
+    """
+    return int(state.translate(_DIGITS), 6).to_bytes(width, 'big')
+
+def unpack_state(key, n):
+    """
+    Input:
+        key (bytes): A packed state
+        n (int): The width and height of the Rubik's cube
+
+    Description:
+        Reverses pack_state.
+
+    Output:
+        The flat cube state (bytes).
+    """
+    value = int.from_bytes(key, 'big')
+    digits = bytearray(6 * n * n)
+    for i in range(len(digits) - 1, -1, -1):
+        value, digits[i] = divmod(value, 6)
+    return bytes(digits)
+
+def moves_crc(actions, n = 3):
+    """
+    Input:
+        actions (list): The move tuples used to build the database
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Fingerprints a move set and the facelet permutations of its moves, so a database built
+        with other moves, or with moves that turned differently, is detected.
+
+    Output:
+        crc32 checksum (int).
+    """
+    moves = [[list(a), list(move_permutation(n, a))] for a in actions]
+    return zlib.crc32(json.dumps(moves).encode('utf-8'))
+
+def write_heuristic_db(path, heuristic, n, actions, depth, colors, canonical = False):
+    """
+    Input:
+        path (str): Path of the database file
+        heuristic (dict): The heuristic map (flat state -> distance, see build_heuristic_db)
+        n (int): The width and height of the Rubik's cube
+        actions (list): The move tuples the map was built with
+        depth (int): The max depth the map was built to
+        colors (list): The colors in index order of the flat states
+        canonical (bool): The map is keyed by canonical states (see cube.canonical_state) (Default: False)
+
+    Description:
+        Writes the heuristic map to a compact binary file that HeuristicDB can memory-map.
+        The file is written next to the target and renamed, so a crash never leaves a broken database.
+
+    Output:
+        None
+    """
+    width = key_width(n)
+    entries = []
+    for state, d in heuristic.items():
+        if isinstance(state, str):
+            state = encode_state(state, colors)[0]
+        entries.append((pack_state(state, width), d))
+    _write_entries(path, entries, n, actions, depth, colors, canonical)
+
+def add_heuristic_layer(path, states, depth):
+    """
+    Input:
+        path (str): Path of an existing database file
+        states (iterable): flat states of the new layer (not in the database yet)
+        depth (int): Their distance, the new depth of the database
+
+    Description:
+        Rewrites the database with one more layer in one pass over the stored entries: every bucket
+        is read once, split into the buckets of the grown file and merged with the sorted new layer.
+        Only the new layer and one bucket are held in memory, the stored entries are copied as
+        packed keys and nothing is unpacked.
+
+    Output:
+        None
+    """
+    with HeuristicDB(path) as db:
+        mm, w = db._mm, db.width
+        count = db.count
+        keys = [pack_state(s, w) for s in states]
+        old_bits = db._mask.bit_length()
+        bits = max(old_bits, _bucket_bits(count + len(keys)))
+        shift, split = 32 - bits, bits - old_bits
+        layer = sorted((zlib.crc32(key) >> shift, key) for key in keys)
+
+        buckets = array('Q', bytes(8 * ((1 << bits) + 1)))
+        tmp = f'{path}.tmp'
+        with open(tmp, 'wb') as keys_file, open(tmp, 'r+b') as depths_file:
+            meta = _write_header(keys_file, db.n, depth, bits, db.actions, count + len(layer), db.colors, db.canonical)
+            keys_file.seek(len(meta) + 8 * len(buckets))
+            depths_file.seek(keys_file.tell() + (count + len(layer)) * w)
+
+            base, depths, position = db._keys_offset, db._depths_offset, 0
+            for b in range(db._mask + 1):
+                # A bucket of the old file is the run of buckets b << split ... ((b + 1) << split) - 1 of the new one
+                entries = []
+                for i in range(db._buckets[b], db._buckets[b + 1]):
+                    key = mm[base + i * w:base + i * w + w]
+                    entries.append((zlib.crc32(key) >> shift, key, mm[depths + i]))
+                end = (b + 1) << split
+                while position < len(layer) and layer[position][0] < end:
+                    entries.append(layer[position] + (depth,))
+                    position += 1
+                entries.sort()
+                for j, key, d in entries:
+                    buckets[j + 1] += 1
+                keys_file.write(b''.join(key for _, key, _ in entries))
+                depths_file.write(bytes(d for _, _, d in entries))
+    for i in range(1, len(buckets)):
+        buckets[i] += buckets[i - 1]
+    with open(tmp, 'r+b') as f:
+        f.seek(len(meta))
+        f.write(struct.pack(f'<{len(buckets)}Q', *buckets))
+    os.replace(tmp, path)
+
+def _bucket_bits(count):
+    return min(32, max(1, (count // 8).bit_length()))
+
+def _write_header(f, n, depth, bits, actions, count, colors, canonical):
+    # Writes the header and the metadata, returns both (the buckets follow)
+    meta = json.dumps({'actions': [list(a) for a in actions], 'colors': list(colors), 'canonical': canonical}).encode('utf-8')
+    meta += b'\x00' * (-(HEADER.size + len(meta)) % 8)
+    head = HEADER.pack(MAGIC, VERSION, n, depth, bits, moves_crc(actions, n), count, len(meta)) + meta
+    f.write(head)
+    return head
+
+def _write_entries(path, entries, n, actions, depth, colors, canonical):
+    bits = _bucket_bits(len(entries))
+    shift = 32 - bits
+    entries = sorted((zlib.crc32(key) >> shift, key, d) for key, d in entries)
+
+    buckets = [0] * ((1 << bits) + 1)
+    for b, _, _ in entries:
+        buckets[b + 1] += 1
+    for i in range(1, len(buckets)):
+        buckets[i] += buckets[i - 1]
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        _write_header(f, n, depth, bits, actions, len(entries), colors, canonical)
+        f.write(struct.pack(f'<{len(buckets)}Q', *buckets))
+        f.write(b''.join(key for _, key, _ in entries))
+        f.write(bytes(d for _, _, d in entries))
+    os.replace(tmp, path)
+
+#############################################
+########   Breadth-First Checkpoints   ######
+#############################################
+# The state of a database build next to the database (<database>.frontier):
+#   header      FRONTIER_MAGIC, version, n, depth, canonical, move set crc32, position, three set sizes
+#   previous    the layer before the frontier (raw flat states)
+#   frontier    the deepest layer of the database, sorted
+#   layer       the children of the first position frontier states (the next layer in progress)
+
+FRONTIER_MAGIC = b'RCBFS\x00\x00\x00'
+FRONTIER_VERSION = 2
+FRONTIER_HEADER = struct.Struct('<8sBBBBIQQQQ')
+
+def write_frontier(path, n, actions, depth, canonical, previous, frontier, layer = (), position = 0):
+    """
+    Input:
+        path (str): Path of the frontier file
+        n (int): The width and height of the Rubik's cube
+        actions (list): The move tuples of the search
+        depth (int): The depth of the frontier
+        canonical (bool): The states are canonical states
+        previous (iterable): The layer before the frontier
+        frontier (list): The frontier, sorted
+        layer (iterable): Children of the first position frontier states (Default: ())
+        position (int): Number of expanded frontier states (Default: 0)
+
+    Description:
+        Saves the state of a breadth-first search, written next to the target and renamed.
+
+    Output:
+        None
+    """
+    previous, layer = list(previous), list(layer)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(FRONTIER_HEADER.pack(FRONTIER_MAGIC, FRONTIER_VERSION, n, depth, canonical, moves_crc(actions, n),
+                                     position, len(previous), len(frontier), len(layer)))
+        for states in (previous, frontier, layer):
+            f.write(b''.join(states))
+    os.replace(tmp, path)
+
+def read_frontier(path):
+    """
+    Input:
+        path (str): Path of a frontier file (see write_frontier)
+
+    Description:
+        Loads the state of a breadth-first search.
+        Raises a ValueError if the file is broken.
+
+    Output:
+        Dictionary with n, depth, canonical, crc, position, previous (set), frontier (list) and layer (set).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        magic, version, n, depth, canonical, crc, position, *sizes = FRONTIER_HEADER.unpack_from(data, 0)
+    except struct.error:
+        raise ValueError(f'{path} is not a frontier file') from None
+    size = 6 * n * n
+    if magic != FRONTIER_MAGIC or version != FRONTIER_VERSION or len(data) != FRONTIER_HEADER.size + sum(sizes) * size:
+        raise ValueError(f'{path} is not a frontier file (version {FRONTIER_VERSION})')
+    sets, offset = [], FRONTIER_HEADER.size
+    for count in sizes:
+        sets.append([data[i:i + size] for i in range(offset, offset + count * size, size)])
+        offset += count * size
+    return {'n': n, 'depth': depth, 'canonical': bool(canonical), 'crc': crc, 'position': position,
+            'previous': set(sets[0]), 'frontier': sets[1], 'layer': set(sets[2])}
+
+class HeuristicDB(Mapping):
+    def __init__(self, path, n = None, actions = None, depth = None, colors = None, canonical = None):
+        """
+        Input:
+            path (str): Path of the database file (see write_heuristic_db)
+            n (int): Expected cube size (Default: None, not checked)
+            actions (list): Expected move set (Default: None, not checked)
+            depth (int): Expected depth (Default: None, not checked)
+            colors (list): Expected colors (Default: None, not checked)
+            canonical (bool): Expect canonical keys (Default: None, not checked)
+
+        Description:
+            Memory-maps a binary heuristic database. Lookups binary search the bucket of the
+            packed state directly in the mapped file, nothing is deserialized.
+            If self.canonical is set, the keys are canonical states and lookups have to be canonicalized.
+            Raises a ValueError if the file is broken or does not match the expected parameters.
+
+        Output:
+            None
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open(n, actions, depth, colors, canonical)
+        except Exception:
+            self.close()
+            raise
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of copying it
+        return HeuristicDB, (self.path,)
+
+    def _open(self, n, actions, depth, colors, canonical):
+        if len(self._mm) < HEADER.size:
+            raise ValueError(f'{self.path} is not a heuristic database')
+        magic, version, self.n, self.depth, bits, crc, self.count, meta_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path} is not a heuristic database (version {VERSION})')
+        meta = json.loads(bytes(self._mm[HEADER.size:HEADER.size + meta_len]).rstrip(b'\x00'))
+        self.actions = [tuple(a) for a in meta['actions']]
+        self.colors = meta['colors']
+        self.canonical = meta.get('canonical', False)
+        self.width = key_width(self.n)
+
+        self._mask = (1 << bits) - 1
+        self._shift = 32 - bits
+        buckets_offset = HEADER.size + meta_len
+        self._keys_offset = buckets_offset + (self._mask + 2) * 8
+        self._depths_offset = self._keys_offset + self.count * self.width
+        if len(self._mm) != self._depths_offset + self.count or crc != moves_crc(self.actions, self.n):
+            raise ValueError(f'{self.path} is truncated or corrupted')
+        self._buckets = memoryview(self._mm)[buckets_offset:self._keys_offset].cast('Q')
+
+        if actions is not None and [tuple(a) for a in actions] != self.actions:
+            raise ValueError(f'{self.path} was built for a different move set')
+        expected = {'cube size': (n, self.n), 'depth': (depth, self.depth), 'colors': (colors, self.colors),
+                    'canonical keys': (canonical, self.canonical)}
+        for name, (want, have) in expected.items():
+            if want is not None and want != have:
+                raise ValueError(f'{self.path} was built for {name} {have}, expected {want}')
+
+    def close(self):
+        """
+        Input:
+            None
+
+        Description:
+            Releases the memory-mapped file.
+
+        Output:
+            None
+        """
+        if getattr(self, '_buckets', None) is not None:
+            self._buckets.release()
+            self._buckets = None
+        self._mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, state, default = None):
+        """
+        Input:
+            state (bytes or str): A flat cube state or its string representation
+            default: Value returned for unknown states (Default: None)
+
+        Description:
+            Looks up the stored distance of a state.
+
+        Output:
+            The distance (int) or default.
+        """
+        if isinstance(state, str):
+            state = encode_state(state, self.colors)[0]
+        key = pack_state(state, self.width)
+        b = zlib.crc32(key) >> self._shift
+        lo, hi = self._buckets[b], self._buckets[b + 1]
+        mm, w, base = self._mm, self.width, self._keys_offset
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = mm[base + mid * w:base + mid * w + w]
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return mm[self._depths_offset + mid]
+        return default
+
+    def __getitem__(self, state):
+        d = self.get(state)
+        if d is None:
+            raise KeyError(state)
+        return d
+
+    def __contains__(self, state):
+        return self.get(state) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        mm, w, base = self._mm, self.width, self._keys_offset
+        for i in range(self.count):
+            yield unpack_state(mm[base + i * w:base + i * w + w], self.n)
+
+    def layer(self, depth):
+        """
+        Input:
+            depth (int): A distance
+
+        Description:
+            Collects the stored states with the given distance.
+
+        Output:
+            List of flat states.
+        """
+        mm, w, base = self._mm, self.width, self._keys_offset
+        depths = mm[self._depths_offset:self._depths_offset + self.count]
+        d, states = bytes([depth]), []
+        i = depths.find(d)
+        while i != -1:
+            states.append(unpack_state(mm[base + i * w:base + i * w + w], self.n))
+            i = depths.find(d, i + 1)
+        return states
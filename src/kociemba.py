@@ -0,0 +1,405 @@
+import os
+import struct
+import time
+from array import array
+from math import comb
+
+from cube import encode_state, move_actions
+from cubie import (cubie_moves, facelets_to_cubies, frame_moves, is_solvable, multiply, rank_orientation,
+                   rank_permutation, unrank_orientation, unrank_permutation)
+from database import moves_crc
+from pattern_db import distance_table
+
+#############################################
+#######   Kociemba Two-Phase Solver   #######
+#############################################
+# Phase 1 turns the cube into the subgroup <U, D, R2, L2, F2, B2>: every corner twist and
+# edge flip is zero and the four middle layer edges (FR, FL, BL, BR) are in the middle layer.
+# Phase 2 solves the cube with the moves of that subgroup. Both phases run IDA* on coordinates:
+#   phase 1     twist (3^7), flip (2^11), slice (positions of the middle layer edges, C(12, 4))
+#   phase 2     corner permutation (8!), up/down edge permutation (8!), middle edge permutation (4!)
+# with move tables for every coordinate and two pruning tables per phase.
+#
+# The search works on the 18 face moves (a quarter turn, a half turn and a quarter turn back
+# of every face). The repo's moves are quarter turns, a half turn becomes two of them.
+#
+# File layout: header (MAGIC, version, move set crc32), then the tables in TABLES order.
+
+MAGIC = b'RCKOC\x00\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sBxxxI')
+
+# Face -> (type, layer) of the repo move that turns it
+FACE_ACTIONS = {'U': ('h', 0), 'R': ('v', 2), 'F': ('s', 2), 'D': ('h', 2), 'L': ('v', 0), 'B': ('s', 0)}
+FACES = 'URFDLB'
+# Move m turns face FACES[m // 3] (m % 3 + 1) quarter turns
+MOVES = [(f, p) for f in FACES for p in (1, 2, 3)]
+PHASE2_MOVES = [m for m, (f, p) in enumerate(MOVES) if f in 'UD' or p == 2]
+
+N_TWIST, N_FLIP, N_SLICE = 3 ** 7, 2 ** 11, comb(12, 4)
+N_CORNERS, N_UD_EDGES, N_SLICE_EDGES = 40320, 40320, 24
+SLICE_SOLVED = sum(comb(8 + i, i + 1) for i in range(4))
+
+# name, typecode, entries
+TABLES = [
+    ('twist_move', 'H', N_TWIST * 18),
+    ('flip_move', 'H', N_FLIP * 18),
+    ('slice_move', 'H', N_SLICE * 18),
+    ('corners_move', 'H', N_CORNERS * 10),
+    ('ud_edges_move', 'H', N_UD_EDGES * 10),
+    ('slice_edges_move', 'B', N_SLICE_EDGES * 10),
+    ('twist_prune', 'B', N_TWIST * N_SLICE),
+    ('flip_prune', 'B', N_FLIP * N_SLICE),
+    ('corners_prune', 'B', N_CORNERS * N_SLICE_EDGES),
+    ('ud_edges_prune', 'B', N_UD_EDGES * N_SLICE_EDGES)
+]
+
+def _face_moves():
+    """
+    The cubie state of every move in MOVES (valid for center-normalized states).
+    """
+    moves = []
+    for f, p in MOVES:
+        t, layer = FACE_ACTIONS[f]
+        quarter = cubie_moves()[(t, layer, 0)]
+        state = quarter
+        for _ in range(p - 1):
+            state = multiply(state, quarter)
+        moves.append(state)
+    return moves
+
+def slice_coordinate(ep):
+    """
+    Input:
+        ep (list): edge permutation
+
+    Description:
+        Ranks the set of positions that hold the middle layer edges (8-11).
+
+    Output:
+        Coordinate between 0 and C(12, 4) - 1 (SLICE_SOLVED when they are in the middle layer).
+    """
+    positions = [i for i, e in enumerate(ep) if e >= 8]
+    return sum(comb(p, k + 1) for k, p in enumerate(positions))
+
+def _slice_positions(coordinate):
+    positions = []
+    for k in range(4, 0, -1):
+        p = k - 1
+        while comb(p + 1, k) <= coordinate:
+            p += 1
+        positions.append(p)
+        coordinate -= comb(p, k)
+    return positions[::-1]
+
+def phase1_coordinates(cubies):
+    """
+    Input:
+        cubies (tuple): cubie state (cp, co, ep, eo)
+
+    Description:
+        Computes the phase 1 coordinates.
+
+    Output:
+        Tuple (twist, flip, slice).
+    """
+    cp, co, ep, eo = cubies
+    return rank_orientation(co[:7], 3), rank_orientation(eo[:11], 2), slice_coordinate(ep)
+
+def phase2_coordinates(cubies):
+    """
+    Input:
+        cubies (tuple): cubie state (cp, co, ep, eo) inside the phase 2 subgroup
+
+    Description:
+        Computes the phase 2 coordinates.
+
+    Output:
+        Tuple (corners, ud_edges, slice_edges).
+    """
+    cp, co, ep, eo = cubies
+    return rank_permutation(cp), rank_permutation(ep[:8]), rank_permutation([e - 8 for e in ep[8:]])
+
+def build_two_phase_tables(path):
+    """
+    Input:
+        path (str): Path of the table file
+
+    Description:
+        Computes the move tables of all coordinates and the pruning tables of both phases
+        (breadth-first searches over twist x slice, flip x slice, corners x middle edges and
+        up/down edges x middle edges) and writes them to the file.
+
+    Output:
+        None
+    """
+    moves = _face_moves()
+    phase2 = [moves[m] for m in PHASE2_MOVES]
+    tables = {}
+
+    twist_move = array('H', bytes(2 * N_TWIST * 18))
+    for r in range(N_TWIST):
+        co = unrank_orientation(r, 3, 7)
+        co.append(-sum(co) % 3)
+        for m, (move_cp, move_co, _, _) in enumerate(moves):
+            twist_move[r * 18 + m] = rank_orientation([(co[move_cp[i]] + move_co[i]) % 3 for i in range(7)], 3)
+    tables['twist_move'] = twist_move
+
+    flip_move = array('H', bytes(2 * N_FLIP * 18))
+    for r in range(N_FLIP):
+        eo = unrank_orientation(r, 2, 11)
+        eo.append(sum(eo) % 2)
+        for m, (_, _, move_ep, move_eo) in enumerate(moves):
+            flip_move[r * 18 + m] = rank_orientation([(eo[move_ep[i]] + move_eo[i]) % 2 for i in range(11)], 2)
+    tables['flip_move'] = flip_move
+
+    slice_move = array('H', bytes(2 * N_SLICE * 18))
+    for r in range(N_SLICE):
+        ep = [0] * 12
+        for p in _slice_positions(r):
+            ep[p] = 8
+        for m, (_, _, move_ep, _) in enumerate(moves):
+            slice_move[r * 18 + m] = slice_coordinate([ep[move_ep[i]] for i in range(12)])
+    tables['slice_move'] = slice_move
+
+    corners_move = array('H', bytes(2 * N_CORNERS * 10))
+    ud_edges_move = array('H', bytes(2 * N_UD_EDGES * 10))
+    for r in range(N_CORNERS):
+        perm = unrank_permutation(r, 8)
+        for k, (move_cp, _, move_ep, _) in enumerate(phase2):
+            corners_move[r * 10 + k] = rank_permutation([perm[i] for i in move_cp])
+            ud_edges_move[r * 10 + k] = rank_permutation([perm[i] for i in move_ep[:8]])
+    tables['corners_move'] = corners_move
+    tables['ud_edges_move'] = ud_edges_move
+
+    slice_edges_move = array('B', bytes(N_SLICE_EDGES * 10))
+    for r in range(N_SLICE_EDGES):
+        perm = [0] * 8 + [8 + e for e in unrank_permutation(r, 4)]
+        for k, (_, _, move_ep, _) in enumerate(phase2):
+            slice_edges_move[r * 10 + k] = rank_permutation([perm[i] - 8 for i in move_ep[8:]])
+    tables['slice_edges_move'] = slice_edges_move
+
+    def expander(a_move, b_move, b_size, n_moves):
+        def expand(index):
+            a, b = divmod(index, b_size)
+            a, b = a * n_moves, b * n_moves
+            return [a_move[a + m] * b_size + b_move[b + m] for m in range(n_moves)]
+        return expand
+
+    tables['twist_prune'] = distance_table(N_TWIST * N_SLICE, SLICE_SOLVED,
+                                           expander(twist_move, slice_move, N_SLICE, 18), 'Phase 1 twist x slice')
+    tables['flip_prune'] = distance_table(N_FLIP * N_SLICE, SLICE_SOLVED,
+                                          expander(flip_move, slice_move, N_SLICE, 18), 'Phase 1 flip x slice')
+    tables['corners_prune'] = distance_table(N_CORNERS * N_SLICE_EDGES, 0,
+                                             expander(corners_move, slice_edges_move, N_SLICE_EDGES, 10),
+                                             'Phase 2 corners x slice edges')
+    tables['ud_edges_prune'] = distance_table(N_UD_EDGES * N_SLICE_EDGES, 0,
+                                              expander(ud_edges_move, slice_edges_move, N_SLICE_EDGES, 10),
+                                              'Phase 2 edges x slice edges')
+
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, moves_crc(move_actions(3))))
+        for name, _, _ in TABLES:
+            f.write(bytes(tables[name]))
+    os.replace(tmp, path)
+
+def load_two_phase_tables(directory, build = True):
+    """
+    Input:
+        directory (str): Directory of the table file (kociemba.tables)
+        build (bool): Build a missing or mismatched table file (Default: True)
+
+    Description:
+        Reads the move and pruning tables of the two-phase solver, building them first if needed.
+
+    Output:
+        Dictionary mapping the table names (see TABLES) to arrays.
+    """
+    path = os.path.join(directory, 'kociemba.tables')
+    size = HEADER.size + sum(array(t).itemsize * n for _, t, n in TABLES)
+    for attempt in range(2):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            magic, version, crc = HEADER.unpack_from(data, 0)
+            if magic != MAGIC or version != VERSION or crc != moves_crc(move_actions(3)) or len(data) != size:
+                raise ValueError(f'{path} is not a two-phase table file (version {VERSION})')
+            break
+        except (FileNotFoundError, ValueError, struct.error) as e:
+            if not build or attempt:
+                raise
+            if not isinstance(e, FileNotFoundError):
+                print(f'WARNING - {e}, rebuilding the two-phase tables')
+            build_two_phase_tables(path)
+
+    tables, offset = {}, HEADER.size
+    for name, typecode, n in TABLES:
+        table = array(typecode)
+        table.frombytes(data[offset:offset + table.itemsize * n])
+        tables[name] = table
+        offset += table.itemsize * n
+    return tables
+
+class Kociemba(object):
+    def __init__(self, tables, max_depth = 30, colors = None, time_budget = None):
+        """
+        Input:
+            tables (dict): The tables of load_two_phase_tables
+            max_depth (int): Longest solution searched for, in face moves (Default: 30)
+            colors (list): colors in the index order of the faces (Default: None, the default cube colors)
+            time_budget (float): Default time budget of run in seconds (Default: None)
+
+        Description:
+            Two-phase solver for the 3x3 cube. Finds a solution of about 20-25 face moves
+            for any solvable state, or improves it for as long as a time budget allows.
+            Setting self.cancel (a flag with is_set(), e.g. a threading.Event) stops the search,
+            run then returns the best solution found so far.
+
+        Output:
+            None
+        """
+        self.tables = tables
+        self.max_depth = max_depth
+        self.colors = colors or ['w', 'o', 'g', 'r', 'b', 'y']
+        self.moves = []
+        self.nodes = 0
+        self.time_budget = time_budget
+        self.cancel = None
+        self._cubie_moves = _face_moves()
+        # The phase 2 moves (index in the move tables, move, face) allowed after a move of face last,
+        # at index last + 1 (-1 for none): not the same face again, opposite faces in one order only
+        self._phase2_moves = [[(k, m, m // 3) for k, m in enumerate(PHASE2_MOVES) if m // 3 != last and m // 3 != last - 3]
+                              for last in range(-1, 6)]
+
+    def run(self, state, time_budget = None):
+        """
+        Input:
+            state (str): representing the current state of the cube
+            time_budget (float): Seconds to keep looking for shorter solutions (Default: None, self.time_budget)
+
+        Description:
+            Iterates the length of phase 1. For every phase 1 solution phase 2 searches
+            the rest, only accepting solutions shorter than the best one so far.
+            With a time budget the search goes on
+            until the budget is used up or no phase 1 length can give a shorter solution.
+            Without any budget the first solution is returned.
+            Raises a ValueError if the state can not be solved.
+            The number of generated nodes is kept in self.nodes.
+
+        Output:
+            list containing the moves taken to solve the cube (repo move tuples, half turns as two quarter turns)
+        """
+        if time_budget is None:
+            time_budget = self.time_budget
+        flat, _ = encode_state(state, self.colors)
+        cubies = facelets_to_cubies(flat)
+        if not is_solvable(*cubies):
+            raise ValueError('the state is not solvable')
+
+        self.cubies = cubies
+        self.nodes = 0
+        self.best = None
+        self.deadline = None if time_budget is None else time.perf_counter() + time_budget
+        self.path = []
+
+        twist, flip, slc = phase1_coordinates(cubies)
+        t = self.tables
+        depth = max(t['twist_prune'][twist * N_SLICE + slc], t['flip_prune'][flip * N_SLICE + slc])
+        while depth <= self.max_depth and (self.best is None or depth < len(self.best)):
+            if self._phase1(twist, flip, slc, depth) or (self.cancel is not None and self.cancel.is_set()):
+                break
+            depth += 1
+
+        self.moves = []
+        if self.best is not None:
+            frame = frame_moves(flat)
+            for m in self.best:
+                f, p = MOVES[m]
+                t, layer = FACE_ACTIONS[f]
+                quarter = [(t, layer, 1)] if p == 3 else [(t, layer, 0)] * p
+                self.moves.extend(frame[a] for a in quarter)
+        return self.moves
+
+    def _phase1(self, twist, flip, slc, togo):
+        """
+        Depth-first search for phase 1 solutions of exactly togo more moves.
+        Returns True when the search should stop.
+        """
+        path = self.path
+        if togo == 0:
+            # A phase 1 solution ending in a phase 2 move was already tried one move shorter
+            if path and path[-1] in PHASE2_MOVES:
+                return False
+            return self._start_phase2()
+
+        if self.deadline is not None and time.perf_counter() > self.deadline and self.best is not None:
+            return True
+        if self.cancel is not None and self.cancel.is_set():
+            return True
+
+        t = self.tables
+        twist_move, flip_move, slice_move = t['twist_move'], t['flip_move'], t['slice_move']
+        twist_prune, flip_prune = t['twist_prune'], t['flip_prune']
+        last = path[-1] // 3 if path else -1
+        for m in range(18):
+            face = m // 3
+            # Same face twice is one move, opposite faces commute (only try them in one order)
+            if face == last or face == last - 3:
+                continue
+            tw, fl, sl = twist_move[twist * 18 + m], flip_move[flip * 18 + m], slice_move[slc * 18 + m]
+            self.nodes += 1
+            if max(twist_prune[tw * N_SLICE + sl], flip_prune[fl * N_SLICE + sl]) >= togo:
+                continue
+            path.append(m)
+            stop = self._phase1(tw, fl, sl, togo - 1)
+            path.pop()
+            if stop:
+                return True
+        return False
+
+    def _start_phase2(self):
+        """
+        Searches phase 2 from the end of the current phase 1 path.
+        Returns True when the search should stop.
+        """
+        limit = self.max_depth if self.best is None else len(self.best) - 1
+        limit -= len(self.path)
+        if limit < 0:
+            return False
+
+        cubies = self.cubies
+        for m in self.path:
+            cubies = multiply(cubies, self._cubie_moves[m])
+        corners, ud_edges, slice_edges = phase2_coordinates(cubies)
+        t = self.tables
+        depth = max(t['corners_prune'][corners * 24 + slice_edges], t['ud_edges_prune'][ud_edges * 24 + slice_edges])
+        last = self.path[-1] // 3 if self.path else -1
+        for togo in range(depth, limit + 1):
+            moves = []
+            if self._phase2(corners, ud_edges, slice_edges, togo, last, moves):
+                self.best = self.path + moves
+                return self.deadline is None
+        return False
+
+    def _phase2(self, corners, ud_edges, slice_edges, togo, last, moves):
+        """
+        Depth-first search for phase 2 solutions of exactly togo more moves.
+        """
+        if togo == 0:
+            return corners == 0 and ud_edges == 0 and slice_edges == 0
+
+        t = self.tables
+        corners_move, ud_edges_move, slice_edges_move = t['corners_move'], t['ud_edges_move'], t['slice_edges_move']
+        corners_prune, ud_edges_prune = t['corners_prune'], t['ud_edges_prune']
+        following = self._phase2_moves[last + 1]
+        self.nodes += len(following)
+        for k, m, face in following:
+            c, u, s = corners_move[corners * 10 + k], ud_edges_move[ud_edges * 10 + k], slice_edges_move[slice_edges * 10 + k]
+            if corners_prune[c * 24 + s] >= togo or ud_edges_prune[u * 24 + s] >= togo:
+                continue
+            moves.append(m)
+            if self._phase2(c, u, s, togo - 1, face, moves):
+                return True
+            moves.pop()
+        return False
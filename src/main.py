@@ -1,194 +1,199 @@
-import json
+import time
+STARTED = time.perf_counter()
+
 import os.path
+from collections import deque
+from functools import lru_cache, partial
 from ursina import *
 
-from cube import RubiksCube
-from solver import IDA_star, build_heuristic_db
+from background import BackgroundSolver
+from batch import load_heuristic
+from cube import RubiksCube, facelet_coordinates, move_permutation
+from kociemba import load_two_phase_tables
+from stats import format_record
 
 #############################################
 #########   Heuristic Database   ############ 
 #############################################
-MAX_MOVES = 5
+MAX_MOVES = 7
 NEW_HEURISTICS = False
-HEURISTIC_FILE = os.path.join(os.path.dirname(__file__), 'heuristic.json')
-
-cube = RubiksCube(n=3)
-
-if os.path.exists(HEURISTIC_FILE):
-    with open(HEURISTIC_FILE) as f:
-        h_db = json.load(f)
+SOLVER = 'ida' # 'ida' for optimal solutions, 'kociemba' for fast solutions of deep scrambles
+TIME_BUDGET = 1 # seconds the two-phase solver keeps improving its solution
+SIZE = 3 # width of the cube, the solvers need a 3x3 cube
+PLAY_RATE = 4 # moves per second of the "play" button
+
+cube = RubiksCube(n=SIZE)
+
+# Heuristic database up to MAX_MOVES, corner and edge pattern databases for deeper states (or the two-phase tables).
+# They are loaded (or built) by the background solver, so the window opens right away, and the solver
+# runs in the background, so the window keeps rendering while it searches
+if SOLVER == 'kociemba':
+    load = partial(load_two_phase_tables, os.path.dirname(__file__))
 else:
-    h_db = None
-
-if h_db is None or NEW_HEURISTICS is True:
-    actions = [(r, n, d) for r in ['h', 'v', 's'] for d in [0, 1] for n in range(cube.n)]
-    h_db = build_heuristic_db(
-        cube.stringify(),
-        actions,
-        max_moves = MAX_MOVES,
-        heuristic = h_db
-    )
-
-    with open(HEURISTIC_FILE, 'w', encoding='utf-8') as f:
-        json.dump(
-            h_db,
-            f,
-            ensure_ascii=False,
-            indent=4
-        )
+    load = partial(load_heuristic, os.path.dirname(__file__), MAX_MOVES, rebuild = NEW_HEURISTICS)
+background = BackgroundSolver(SOLVER, load, TIME_BUDGET)
+startup = {}
 
 #############################################
 #######   3D Rubik's Cube Model   ###########
 #############################################
-moves_did = []
+# Keys of the layers (see keyShiftToMoves), the slots of an n x n model are tracked in slots
+KEYS = set('uedlmrfsb')
+OFFSET = (SIZE - 1) / 2
 
-def parent_children(axis, position):
+def cubie_slot(coordinate, n = SIZE):
     """
-    Input: 
-        axis (str): 'x', 'y', or 'z'
-        position (int): 0, 1, or 2
-    
+    Input:
+        coordinate (tuple): doubled coordinate of a facelet (see cube.facelet_coordinates)
+        n (int): The width and height of the Rubik's cube (Default: SIZE)
+
     Description:
-        Parent all cubes to the center cube that are in the same position as the given axis and position.
+        Find the slot of the cubie the facelet belongs to. Slots are the grid indices (x, y, z) of the 3D model,
+        the model has its front at -z, the logical cube at +z.
 
     Output:
-        None
+        slot (tuple): (x, y, z), each in range(n)
     """
-    for c in cubeA:
-        c.position, c.rotation = round(c.world_position,1), c.world_rotation
-        c.parent = scene # remove parent/child relationship
-    
-    center.rotation = 0
+    x, y, z = [v - (v > 0) + (v < 0) if abs(v) == n else v for v in coordinate]
+    return ((x + n - 1) // 2, (y + n - 1) // 2, (-z + n - 1) // 2)
 
-    for c in cubeA:
-        if eval(f'c.position.{axis}') == position:
-            c.parent = center
+def slotPosition(slot):
+    return Vec3(*slot) - Vec3(OFFSET, OFFSET, OFFSET)
 
-def move_noanimation(key, shift=False):
+def move_rotation(move, n = SIZE):
     """
     Input:
-        key (str): key pressed
-        shift (bool): True if shift key is held down, False otherwise (for counter-clockwise rotation)
+        move (tuple): move of the logical cube, e.g. ('h', 0, 0)
+        n (int): The width and height of the Rubik's cube (Default: SIZE)
 
     Description:
-        Rotate the center cube and all cubes that are in the same position as the given axis and position.
-        This function does not animate the rotation.
+        The rotation of the 3D model doing the same move (the angles of the original rotation table).
 
     Output:
-        None
+        Tuple (axis, layer, angle): the axis, the slot index of the turning layer on that axis and the angle in degrees
     """
-    if key not in rotation_dict: return
-    axis, position, angle = rotation_dict[key]
-    parent_children(axis, position)
-    eval(f'center.animate_rotation_{axis} ({-angle if shift else angle}, duration = 0)')
-
-def move_animation(key, shift=False):
+    r, i, d = move
+    if r == 'h':
+        return 'y', n - 1 - i, 90 if d == 0 else -90
+    if r == 'v':
+        return 'x', i, -90 if d == 0 else 90
+    return 'z', n - 1 - i, -90 if d == 0 else 90
+
+@lru_cache(maxsize=None)
+def slotMoves(move, n = SIZE):
     """
-    same as above (with animation)
+    Input:
+        move (tuple): move of the logical cube
+        n (int): The width and height of the Rubik's cube (Default: SIZE)
+
+    Description:
+        Derive where the move takes the cubies from the facelet permutation of the logical cube,
+        so the slot index always agrees with RubiksCube.
+
+    Output:
+        Dictionary old slot -> new slot of the cubies that change their slot
     """
-    if key not in rotation_dict: return
-    axis, position, angle = rotation_dict[key]
-    parent_children(axis, position)
-    eval(f'center.animate_rotation_{axis} ({-angle if shift else angle}, duration = 0.5)')
+    coordinates = facelet_coordinates(n)
+    return {cubie_slot(coordinates[p], n): cubie_slot(coordinates[i], n)
+            for i, p in enumerate(move_permutation(n, move)) if p != i}
 
-def input(key, shift=False):
+def twistModel(move, duration = 0.5):
     """
     Input:
-        key (str): key pressed
-        shift (bool): True if shift key is held down, False otherwise (for counter-clockwise rotation)
+        move (tuple): move of the logical cube
+        duration (float): seconds of the animation, 0 turns the layer right away (Default: 0.5)
 
     Description:
-        Rotate the center cube and all cubes that are in the same position as the given axis and position
-        and printing the move that was done and prints the new state of the cube.
-        This function animates the rotation.
+        Turn one layer of the 3D model. Only the entities of the layer are parented to the center,
+        they are looked up in the slot index, which is updated right away.
+        A turn that is still animating is settled first.
 
     Output:
         None
     """
-    if key not in rotation_dict: return
-    axis, position, angle = rotation_dict[key]
-    parent_children(axis, position)
-    shift = held_keys['shift']
-    eval(f'center.animate_rotation_{axis} ({-angle if shift else angle}, duration = 0.5)')
-    moves_did.append((key, shift))
-    for m in keyShiftToMoves([(key, shift)]):
-        if m[0] == 'h':
-            cube.horizontal_twist(m[1], m[2])
-        elif m[0] == 'v':
-            cube.vertical_twist(m[1], m[2])
-        elif m[0] == 's':
-            cube.side_twist(m[1], m[2])
-    print(keyShiftToMoves([(key, shift)]))
-    cube.show()
-    print('-----------')
+    settle()
+    axis, layer, angle = move_rotation(move)
+    entities = [slots[s] for s in layerSlots[axis, layer]]
+    for e in entities:
+        e.parent = center
+    moved = {new: slots[old] for old, new in slotMoves(move).items()}
+    for s, e in moved.items():
+        e.slot = s
+    slots.update(moved)
+
+    turning.update(entities = entities, axis = axis, angle = angle, sequence = None)
+    if duration > 0:
+        turning['sequence'] = getattr(center, f'animate_rotation_{axis}')(angle, duration = duration)
+    else:
+        settle()
+
+def settle():
+    """
+    Input:
+        None
+
+    Description:
+        Finish the last turn: the turning entities get their exact slot position and rotation
+        and leave the center, so rounding errors never add up.
 
-def movesToKeyShift(moves):
+    Output:
+        None
+    """
+    if not turning: return
+    if turning['sequence'] is not None:
+        turning['sequence'].kill()
+    setattr(center, f'rotation_{turning["axis"]}', turning['angle'])
+    for e in turning['entities']:
+        rotation = Vec3(*[round(a / 90) * 90 for a in e.world_rotation])
+        e.parent = scene
+        e.position, e.rotation = slotPosition(e.slot), rotation
+    center.rotation = (0, 0, 0)
+    turning.clear()
+
+def playMoves(moves, rate = None):
     """
     Input:
-        moves (list): list of moves
+        moves (list): moves of the logical cube
+        rate (float): moves per second, None to fast-forward (Default: None)
 
     Description:
-        convert a move array to an array, which contains the key and shift
-        for example: [('v', 0, 0)] -> [('l', False)]
-        so in the moves array, the first element stands for 'vertical'/'horizontal'/'side-twist', the second for the position and the third for the direction
-        the first element of the return array stands for the key and the second for the shift (like in the rotation_dict)
+        Play a move sequence on the 3D model. Fast-forwarding turns every layer right away,
+        otherwise update() turns the layers one by one at the given rate.
 
     Output:
-        KeyShiftArray (list): list of key and shift
+        None
     """
+    if rate is None:
+        for m in moves:
+            twistModel(m, 0)
+        return
+    playing['moves'].extend(moves)
+    playing['rate'] = rate
+    playing['credit'] = max(playing['credit'], 1)
 
-    KeyShiftArray = []
-    for m in moves:
-        if m[0] == 'v':
-            if m[1] == 0:
-                if m[2] == 0:
-                    KeyShiftArray.append(('l', False))
-                else:
-                    KeyShiftArray.append(('l', True))
-            elif m[1] == 1:
-                if m[2] == 0:
-                    KeyShiftArray.append(('m', False))
-                else:
-                    KeyShiftArray.append(('m', True))
-            else:
-                if m[2] == 0:
-                    KeyShiftArray.append(('r', True))
-                else:
-                    KeyShiftArray.append(('r', False))
-        elif m[0] == 'h':
-            if m[1] == 0:
-                if m[2] == 0:
-                    KeyShiftArray.append(('u', False))
-                else:
-                    KeyShiftArray.append(('u', True))
-            elif m[1] == 1:
-                if m[2] == 0:
-                    KeyShiftArray.append(('e', True))
-                else:
-                    KeyShiftArray.append(('e', False))
-            else:
-                if m[2] == 0:
-                    KeyShiftArray.append(('d', True))
-                else:
-                    KeyShiftArray.append(('d', False))
-        elif m[0] == 's':
-            if m[1] == 0:
-                if m[2] == 0:
-                    KeyShiftArray.append(('b', False))
-                else:
-                    KeyShiftArray.append(('b', True))
-            elif m[1] == 1:
-                if m[2] == 0:
-                    KeyShiftArray.append(('s', True))
-                else:
-                    KeyShiftArray.append(('s', False))
-            else:
-                if m[2] == 0:
-                    KeyShiftArray.append(('f', True))
-                else:
-                    KeyShiftArray.append(('f', False))
-                
-    return KeyShiftArray
+def input(key, shift=False):
+    """
+    Input:
+        key (str): key pressed
+        shift (bool): True if shift key is held down, False otherwise (for counter-clockwise rotation)
+
+    Description:
+        Turn the layer of the key (the outer layers or the middle layer of an n x n cube),
+        printing the move that was done and the new state of the cube.
+        This function animates the rotation.
+
+    Output:
+        None
+    """
+    if key not in KEYS or background.busy() or playing['moves']: return
+    shift = held_keys['shift']
+    r, i, d = keyShiftToMoves([(key, shift)])[0]
+    move = (r, {0: 0, 1: SIZE // 2, 2: SIZE - 1}[i], d)
+    cube.twist(move)
+    twistModel(move, 0.5)
+    print([move])
+    cube.show()
+    print('-----------')
 
 def keyShiftToMoves(KeyShiftArray):
     """
@@ -265,14 +270,14 @@ def resetCube():
     Output:
         None
     """
-    center.rotation = (0,0,0)
+    settle()
+    playing['moves'].clear()
+    slots.clear()
     for c in cubeA:
-        c.rotation = (0,0,0)
         c.parent = scene
-    for c in cubeA:
-        if c.position == (1,1,1):
-            c.parent = center
-    moves_did = []
+        c.slot = c.home
+        c.position, c.rotation = slotPosition(c.home), (0,0,0)
+        slots[c.home] = c
 
 def randomCube():
     """
@@ -296,10 +301,7 @@ def randomCube():
     print(shuffeledMoves)
     cube.show()
     print('----------')
-    shuffeledAnimation = movesToKeyShift(shuffeledMoves)
-    moves_did = shuffeledAnimation
-    for m in shuffeledAnimation:
-        move_noanimation(m[0], m[1])
+    playMoves(shuffeledMoves)
 
     solveBtn.enabled = True
     nextBtn.enabled = False
@@ -312,30 +314,113 @@ def solve():
         None
 
     Description:
-        solve the cube with IDA* algorithm.
-        Prints the moves and the solved state to the console.
+        start solving the cube with IDA* algorithm (or the two-phase algorithm, see SOLVER) in the background.
+        The progress is shown below the cube, update() picks up the solution.
+
+    Output:
+        None
+    """
+    if background.busy(): return
+    if SIZE != 3:
+        print(f'WARNING - the solvers need a 3x3 cube, not {SIZE}x{SIZE}')
+        return
+    background.solve(cube.stringify())
+    solveBtn.enabled = False
+    randomBtn.enabled = False
+    cancelBtn.enabled = True
+    progressText.text = 'solving...'
+
+def cancelSolve():
+    """
+    Input:
+        None
+
+    Description:
+        stop the running solve, update() gets the result of the cancelled search
+
+    Output:
+        None
+    """
+    background.cancel()
+    progressText.text = 'cancelling...'
+
+def update():
+    """
+    Input:
+        None
+
+    Description:
+        called by Ursina every frame: plays the queued moves (see playMoves), reports the startup times,
+        shows the progress of a running solve and hands its solution to finishSolve once it is done
+
+    Output:
+        None
+    """
+    if playing['moves']:
+        playing['credit'] += time.dt * playing['rate']
+        while playing['moves'] and playing['credit'] >= 1:
+            playing['credit'] -= 1
+            twistModel(playing['moves'].popleft(), 1 / playing['rate'])
+        if not playing['moves']:
+            playing['credit'] = 0
+    if 'window' not in startup:
+        startup['window'] = time.perf_counter() - STARTED
+        print(f'STARTUP - window after {startup["window"]:.2f}s')
+    if 'ready' not in startup:
+        background.drain()
+        if background.ready:
+            startup['ready'] = time.perf_counter() - STARTED
+            print(f'STARTUP - solver ready after {startup["ready"]:.2f}s (databases loaded in {background.load_time:.2f}s)')
+    if not background.busy(): return
+    try:
+        result = background.poll()
+    except ValueError as e:
+        print(f'ERROR - {e}')
+        finishSolve([], 'error')
+        return
+    if result is not None:
+        finishSolve(*result)
+        return
+    record = background.last
+    progress = format_record(record) if record is not None else 'solving...' if background.ready else 'loading the databases...'
+    progressText.text = f'{progress}\n{background.elapsed():.1f}s'
+
+def finishSolve(moves, status):
+    """
+    Input:
+        moves (list): the moves of the solution
+        status (str): the status of the search (see solver.SolveResult)
+
+    Description:
+        puts the solution into the movesAnimate queue for the "next move" and "play" buttons,
+        prints the moves and the solved state to the console
 
     Output:
         None
     """
-    solver = IDA_star(h_db)
-    global moves
-    moves = solver.run(cube.stringify())
     global movesAnimate
-    movesAnimate = movesToKeyShift(moves)
+    cancelBtn.enabled = False
+    randomBtn.enabled = True
+    progressText.text = ''
+    if not moves:
+        solveBtn.enabled = True
+        if status != 'solved':
+            progressText.text = f'no solution ({status})'
+            print(f'WARNING - no solution found ({status})')
+        return
+    if status != 'solved':
+        # A stopped search can still hand over a longer solution (see IDA_star.run)
+        progressText.text = f'stopped ({status}), the solution may not be optimal'
+    movesAnimate = list(moves)
 
     print(moves)
 
     for m in moves:
-        if m[0] == 'h':
-            cube.horizontal_twist(m[1], m[2])
-        elif m[0] == 'v':
-            cube.vertical_twist(m[1], m[2])
-        elif m[0] == 's':
-            cube.side_twist(m[1], m[2])
+        cube.twist(m)
     cube.show()
 
     nextBtn.enabled = True
+    playBtn.enabled = True
     solveBtn.enabled = False
 
 def oneMove():
@@ -352,18 +437,40 @@ def oneMove():
     if len(movesAnimate) > 0:
         randomBtn.enabled = False
         solveBtn.enabled = False
-        move_animation(movesAnimate[0][0], movesAnimate[0][1])
-        movesAnimate.pop(0)
+        twistModel(movesAnimate.pop(0), 0.5)
         if len(movesAnimate) == 0:
             randomBtn.enabled = True
             solveBtn.enabled = True
             nextBtn.enabled = False
+            playBtn.enabled = False
+
+def playSolution():
+    """
+    Input:
+        None
+
+    Description:
+        play the rest of the movesAnimate list at PLAY_RATE moves per second
+
+    Output:
+        None
+    """
+    global movesAnimate
+    playMoves(movesAnimate, PLAY_RATE)
+    movesAnimate = []
+    randomBtn.enabled = True
+    solveBtn.enabled = True
+    nextBtn.enabled = False
+    playBtn.enabled = False
 
 ####################################
 ########   Ursina App   ############
 ####################################
 center = Entity()
 cubeA = []
+slots = {} # slot -> entity of the cubie in it (see cubie_slot)
+turning = {} # the last turn until it is settled (see twistModel)
+playing = {'moves': deque(), 'rate': None, 'credit': 0}
 
 app = Ursina()
 window.title = "Rubiks Cube"
@@ -372,15 +479,21 @@ window.borderless = False
 window.size = (800, 800)
 EditorCamera()
 
-rotation_dict = {   'u': ['y', 1, 90],    'e': ['y', 0, -90],    'd': ['y', -1, -90],
-                    'l': ['x', -1, -90],  'm': ['x', 0, -90],    'r': ['x', 1, 90],
-                    'f': ['z', -1, 90],   's': ['z', 0, 90],     'b': ['z', 1, -90]}
-
-for x in range(-1,2):
-    for y in range(-1,2):
-        for z in range(-1,2):
-            pos = (x,y,z)
-            cubeA.append(Entity(model='cube.obj', texture='texture.png', position=pos, scale=0.5))
+# Only the cubies on the surface, bigger cubes have many inner ones
+for x in range(SIZE):
+    for y in range(SIZE):
+        for z in range(SIZE):
+            if all(0 < v < SIZE - 1 for v in (x, y, z)): continue
+            c = Entity(model='cube.obj', texture='texture.png', position=slotPosition((x, y, z)), scale=0.5)
+            c.slot = c.home = (x, y, z)
+            slots[c.home] = c
+            cubeA.append(c)
+
+# The slots of every layer, a turn only touches its own layer
+layerSlots = {}
+for s in slots:
+    for axis, v in zip('xyz', s):
+        layerSlots.setdefault((axis, v), []).append(s)
 
 #--------------------------------
 cube.show()
@@ -390,5 +503,8 @@ print('-----------')
 randomBtn = Button(text='random cube', scale=(0.2, 0.1), position=(-0.3, -0.4), on_click=randomCube, enabled=True)
 solveBtn = Button(text='solve', scale=(0.2, 0.1), position=(0, -0.4), on_click=solve, enabled=True)
 nextBtn = Button(text='next move', scale=(0.2, 0.1), position=(0.3, -0.4), on_click=oneMove, enabled=False)
+playBtn = Button(text='play', scale=(0.2, 0.1), position=(0.3, -0.28), on_click=playSolution, enabled=False)
+cancelBtn = Button(text='cancel', scale=(0.2, 0.1), position=(0, -0.28), on_click=cancelSolve, enabled=False)
+progressText = Text(text='', position=(-0.4, 0.45), scale=0.8)
 
 app.run()
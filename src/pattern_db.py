@@ -0,0 +1,398 @@
+import mmap
+import os
+import struct
+from array import array
+
+from coordinates import EDGE_GROUPS, PACKED, load_coordinate_tables
+from cube import canonical_state, move_actions, recolor_state
+from cubie import (cubie_moves, facelets_to_cubies, partial_count, rank_orientation, rank_partial,
+                   rank_permutation, unrank_partial)
+from database import moves_crc
+from stats import SearchStats, TqdmSink
+
+#############################################
+#######   Pattern Databases (3x3)   #########
+#############################################
+# Korf style pattern databases: the exact distance to solved of an abstracted state
+# (only some cubies are tracked) stored at the perfect rank of that abstracted state.
+#   corners     index = rank(cp) * 3^7 + rank(co[:7])                8! * 3^7 entries
+#   edges E     index = rank_partial(positions of E) * 2^k + flips    12! / (12-k)! * 2^k entries
+# The tables are built with a breadth-first search over the abstracted space and stored
+# as packed nibble arrays. The 18 moves (the middle slices act like the two outer faces
+# next to them) are closed under whole cube rotations, so the distance of the
+# center-normalized state is a lower bound for the facelet search.
+#
+# File layout: header (MAGIC, version, kind, k, move set crc32, entries), the k tracked
+# cubies padded to 8 bytes, then (entries + 1) // 2 bytes of nibbles (even index = low nibble).
+
+MAGIC = b'RCPDB\x00\x00\x00'
+VERSION = 1
+HEADER = struct.Struct('<8sBBHIQ')
+CORNERS, EDGES = 0, 1
+
+CORNER_PATTERN = tuple(range(8))
+EDGE_PATTERNS = [(0, 1, 2, 3, 4, 5), (6, 7, 8, 9, 10, 11)]
+
+def pattern_size(kind, cubies):
+    """
+    Input:
+        kind (int): CORNERS or EDGES
+        cubies (tuple): The tracked cubies
+
+    Description:
+        Computes the number of entries of a pattern database.
+
+    Output:
+        Number of entries (int).
+    """
+    if kind == CORNERS:
+        return partial_count(8, 8) * 3 ** 7
+    return partial_count(12, len(cubies)) * 2 ** len(cubies)
+
+def pattern_index(kind, cubies, state):
+    """
+    Input:
+        kind (int): CORNERS or EDGES
+        cubies (tuple): The tracked cubies
+        state (tuple): cubie state (cp, co, ep, eo)
+
+    Description:
+        Ranks the abstracted cubie state.
+
+    Output:
+        Index into the pattern database (int).
+    """
+    cp, co, ep, eo = state
+    if kind == CORNERS:
+        return rank_permutation(cp) * 2187 + rank_orientation(co[:7], 3)
+    positions = [ep.index(e) for e in cubies]
+    return (rank_partial(positions, 12) << len(cubies)) | rank_orientation([eo[p] for p in positions], 2)
+
+def _corner_expander(tables):
+    # The corner index is the corners and twist coordinates (see coordinates.py)
+    corners_move, twist_move = tables['corners_move'], tables['twist_move']
+
+    def expand(index):
+        p, o = divmod(index, 2187)
+        p, o = p * 18, o * 18
+        return [corners_move[p + m] * 2187 + twist_move[o + m] for m in range(18)]
+    return expand
+
+def _edge_expander(cubies, tables):
+    k = len(cubies)
+    if k == len(EDGE_GROUPS[0]):
+        # The index of six edges is an edge coordinate, its move tables are shared
+        edges_move, flips_move = tables['edges_move'], tables['flips_move']
+
+        def expand(index):
+            p, o = (index >> 6) * 18, index & 63
+            return [(edges_move[p + m] << 6) | (o ^ flips_move[p + m]) for m in range(18)]
+        return expand
+
+    count = partial_count(12, k)
+    mask = (1 << k) - 1
+    selections = [unrank_partial(r, 12, k) for r in range(count)]
+    tables = []
+    for _, _, move_ep, move_eo in cubie_moves().values():
+        # The edge at position q moves to the position i with move_ep[i] == q
+        target = [0] * 12
+        for i, q in enumerate(move_ep):
+            target[q] = i
+        perms = array('I', bytes(4 * count))
+        flips = array('B', bytes(count))
+        for r, positions in enumerate(selections):
+            moved = [target[q] for q in positions]
+            perms[r] = rank_partial(moved, 12)
+            flips[r] = rank_orientation([move_eo[i] for i in moved], 2)
+        tables.append((perms, flips))
+
+    def expand(index):
+        p, o = index >> k, index & mask
+        return [(a[p] << k) | (o ^ b[p]) for a, b in tables]
+    return expand
+
+def distance_table(size, source, expand, desc, stats = None):
+    """
+    Input:
+        size (int): Number of states
+        source (int): Index of the state the distances are measured from
+        expand (function): Maps a state index to the list of its neighbor indices
+        desc (str): Label of the progress bar
+        stats (stats.SearchStats): Gets a record of every layer (Default: None, a progress bar)
+
+    Description:
+        Breadth-first search over all states of an indexed state space. Dense layers are
+        searched bottom-up (every unvisited state looks for a neighbor in the last layer).
+        The number of states and the build time of every layer are reported to the stats.
+
+    Output:
+        bytearray with the distance of every state (255 for unreachable states).
+    """
+    table = bytearray(b'\xff') * size
+    table[source] = 0
+    depth, count, unvisited = 0, 1, size - 1
+    if stats is None:
+        stats = SearchStats([TqdmSink()])
+    stats.start('distance_table', desc=desc)
+    while count and unvisited:
+        stats.begin()
+        d, child = bytes([depth]), depth + 1
+        if count < unvisited:
+            i = table.find(d)
+            while i != -1:
+                for c in expand(i):
+                    if table[c] == 255:
+                        table[c] = child
+                i = table.find(d, i + 1)
+        else:
+            i = table.find(b'\xff')
+            while i != -1:
+                for c in expand(i):
+                    if table[c] == depth:
+                        table[i] = child
+                        break
+                i = table.find(b'\xff', i + 1)
+        depth += 1
+        count = table.count(bytes([depth]))
+        unvisited -= count
+        stats.iteration(depth = depth, states = count)
+    stats.finish()
+    return table
+
+def build_pattern_db(path, kind, cubies):
+    """
+    Input:
+        path (str): Path of the database file
+        kind (int): CORNERS or EDGES
+        cubies (tuple): The tracked cubies
+
+    Description:
+        Builds a pattern database with a breadth-first search over the abstracted states
+        and writes it as a packed nibble array (see distance_table). The moves of the abstracted
+        states come from the coordinate move tables next to the file (see coordinates.py).
+
+    Output:
+        None
+    """
+    size = pattern_size(kind, cubies)
+    tables = load_coordinate_tables(os.path.dirname(path) or '.')
+    expand = _corner_expander(tables) if kind == CORNERS else _edge_expander(cubies, tables)
+    solved = pattern_index(kind, cubies, (list(range(8)), [0] * 8, list(range(12)), [0] * 12))
+    table = distance_table(size, solved, expand, f'Pattern DB {os.path.basename(path)}')
+
+    # Pack two distances per byte
+    if size % 2:
+        table.append(0)
+    low = int.from_bytes(table[0::2], 'little')
+    high = int.from_bytes(table[1::2].translate(bytes((v << 4) & 0xFF for v in range(256))), 'little')
+    nibbles = (low | high).to_bytes(len(table) // 2, 'little')
+
+    tracked = bytes(cubies) + b'\x00' * (-len(cubies) % 8)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, kind, len(cubies), moves_crc(move_actions(3)), size))
+        f.write(tracked)
+        f.write(nibbles)
+    os.replace(tmp, path)
+
+class PatternDB(object):
+    def __init__(self, path, kind, cubies):
+        """
+        Input:
+            path (str): Path of the database file (see build_pattern_db)
+            kind (int): CORNERS or EDGES
+            cubies (tuple): The tracked cubies
+
+        Description:
+            Memory-maps a pattern database.
+            Raises a ValueError if the file does not hold the expected pattern.
+
+        Output:
+            None
+        """
+        self.path = path
+        self.kind = kind
+        self.cubies = tuple(cubies)
+        self.size = pattern_size(kind, cubies)
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offset = HEADER.size + len(self.cubies) + (-len(self.cubies) % 8)
+        try:
+            magic, version, kind, k, crc, size = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f'{path} is not a pattern database (version {VERSION})')
+            if (kind, k, size, crc) != (self.kind, len(self.cubies), self.size, moves_crc(move_actions(3))) \
+                    or tuple(self._mm[HEADER.size:HEADER.size + k]) != self.cubies:
+                raise ValueError(f'{path} was built for another pattern or move set')
+            if len(self._mm) != self._offset + (size + 1) // 2:
+                raise ValueError(f'{path} is truncated or corrupted')
+        except (ValueError, struct.error):
+            self._mm.close()
+            raise
+
+    def close(self):
+        """
+        Input:
+            None
+
+        Description:
+            Releases the memory-mapped file.
+
+        Output:
+            None
+        """
+        self._mm.close()
+
+    def __reduce__(self):
+        # Worker processes map the file again instead of copying it
+        return PatternDB, (self.path, self.kind, self.cubies)
+
+    def __getitem__(self, index):
+        b = self._mm[self._offset + (index >> 1)]
+        return b >> 4 if index & 1 else b & 15
+
+    def lookup(self, state):
+        """
+        Input:
+            state (tuple): cubie state (cp, co, ep, eo)
+
+        Description:
+            Looks up the distance of the abstracted state.
+
+        Output:
+            Lower bound of the distance to solved (int).
+        """
+        return self[pattern_index(self.kind, self.cubies, state)]
+
+def load_pattern_dbs(directory, build = True):
+    """
+    Input:
+        directory (str): Directory of the database files
+        build (bool): Build missing or mismatched databases (Default: True)
+
+    Description:
+        Opens the corner database and the edge subset databases (CORNER_PATTERN and EDGE_PATTERNS),
+        building them first if needed.
+
+    Output:
+        List of PatternDB objects.
+    """
+    patterns = [(CORNERS, CORNER_PATTERN)] + [(EDGES, e) for e in EDGE_PATTERNS]
+    pdbs = []
+    for kind, cubies in patterns:
+        name = 'corners' if kind == CORNERS else 'edges_' + '_'.join(map(str, cubies))
+        path = os.path.join(directory, f'pattern_{name}.db')
+        try:
+            pdbs.append(PatternDB(path, kind, cubies))
+            continue
+        except FileNotFoundError:
+            if not build:
+                raise
+        except ValueError as e:
+            if not build:
+                raise
+            print(f'WARNING - {e}, rebuilding the pattern database')
+        build_pattern_db(path, kind, cubies)
+        pdbs.append(PatternDB(path, kind, cubies))
+    return pdbs
+
+class PatternHeuristic(object):
+    # get counts the lookups of the table itself (see stats.SearchStats.counting)
+    counts_lookups = True
+
+    def __init__(self, pdbs, table = None, canonical_table = None):
+        """
+        Input:
+            pdbs (list): PatternDB objects
+            table (dict): Optional heuristic map of flat states (dict or database.HeuristicDB) (Default: None)
+            canonical_table (bool): The table is keyed by canonical states (Default: None, taken from the table)
+
+        Description:
+            Heuristic for IDA_star that combines the pattern databases (and the table, where it
+            knows the state) with max(), so every state gets an estimate.
+            The table holds every state up to its depth, so it is only looked up
+            if the pattern databases do not already estimate more.
+
+        Output:
+            None
+        """
+        self.pdbs = pdbs
+        self.table = table
+        self.colors = getattr(table, 'colors', None)
+        self.canonical_table = getattr(table, 'canonical', False) if canonical_table is None else canonical_table
+        self.depth = getattr(table, 'depth', None)
+        if self.depth is None and isinstance(table, dict):
+            self.depth = max(table.values(), default=-1)
+
+    def get(self, state, default = None, stats = None):
+        """
+        Input:
+            state (bytes): A flat 3x3 state (color i belongs on face i)
+            default: Unused, every state has an estimate (Default: None)
+            stats (stats.SearchStats): Counts the hits and misses of the table lookups (Default: None)
+
+        Description:
+            Estimates the distance of the state to solved.
+
+        Output:
+            The estimate (int).
+        """
+        cubies = facelets_to_cubies(state)
+        h = max(pdb.lookup(cubies) for pdb in self.pdbs)
+        if self.table is not None and h <= self.depth:
+            # A table that is not canonical is keyed by relabeled states (see solver.build_heuristic_db)
+            d = self.table.get(canonical_state(state) if self.canonical_table else recolor_state(state))
+            if stats is not None:
+                if d is None:
+                    stats.misses += 1
+                else:
+                    stats.hits += 1
+            if d is not None and d > h:
+                h = d
+        return h
+
+class CoordinateHeuristic(object):
+    def __init__(self, pdbs, engine = None):
+        """
+        Input:
+            pdbs (list): PatternDB objects of the corners and of the edge groups of coordinates.EDGE_GROUPS
+            engine (coordinates.CoordinateEngine): The engine IDA_star searches with (Default: None, given to IDA_star)
+
+        Description:
+            Heuristic for IDA_star searching packed coordinate states (see coordinates.CoordinateEngine).
+            The coordinates are the indices of the pattern databases, so a lookup needs no conversion.
+            Raises a ValueError for a pattern that is not a coordinate.
+
+        Output:
+            None
+        """
+        self.pdbs = pdbs
+        self.engine = engine
+        self.corners = self.edges_a = self.edges_b = None
+        for pdb in pdbs:
+            if pdb.kind == CORNERS:
+                self.corners = pdb
+            elif pdb.cubies in EDGE_GROUPS:
+                setattr(self, 'edges_a' if pdb.cubies == EDGE_GROUPS[0] else 'edges_b', pdb)
+            else:
+                raise ValueError(f'the edges {pdb.cubies} are not a coordinate')
+
+    def get(self, state, default = None):
+        """
+        Input:
+            state (bytes): A packed coordinate state
+            default: Unused, every state has an estimate (Default: None)
+
+        Description:
+            Estimates the distance of the state to solved.
+
+        Output:
+            The estimate (int).
+        """
+        c, t, a, b, _ = PACKED.unpack(state)
+        h = 0 if self.corners is None else self.corners[c * 2187 + t]
+        if self.edges_a is not None:
+            h = max(h, self.edges_a[a])
+        if self.edges_b is not None:
+            h = max(h, self.edges_b[b])
+        return h
@@ -0,0 +1,378 @@
+from functools import lru_cache
+
+from cube import (cube_symmetries, decode_state, encode_state, facelet_coordinates, is_solved, move_actions,
+                  move_permutation, move_table, solved_state, transform_permutation)
+from cubie import _parity, facelets_to_cubies, is_solvable
+from kociemba import Kociemba
+
+#############################################
+######   Big Cube Solver (any n >= 2)   #####
+#############################################
+# Big cubes are solved in three stages:
+#   frame    the pieces that behave like a 3x3 cube (corners, and for odd n the middle edges and the
+#            middle centers) are solved by the two-phase solver. For even n the corners are put into a
+#            virtual 3x3 whose edges and centers are solved.
+#   edges    every orbit of wings (the edge pieces at layer k and n-1-k) is solved with pure 3-cycles,
+#            after a single slice turn if the orbit is an odd permutation (the parity of big cubes).
+#   centers  every orbit of center pieces is solved with pure 3-cycles.
+# A 3-cycle is a commutator [A, B] = A B A' B' that moves three pieces of one orbit and nothing else,
+# conjugated with setup moves that bring any three pieces of the orbit to the pieces the commutator cycles.
+# Pure 3-cycles leave the solved stages alone, so no parity algorithms are needed.
+# The commutators and setups are searched once per cube size.
+
+def _inverse(action):
+    return (action[0], action[1], 1 - action[2])
+
+def _compose(p, q):
+    # Permutation of p followed by q (new_state[i] = old_state[p[q[i]]])
+    return tuple(p[j] for j in q)
+
+def _sequence_permutation(n, moves):
+    perm = tuple(range(6 * n * n))
+    for a in moves:
+        perm = _compose(perm, move_permutation(n, a))
+    return perm
+
+def _destinations(perm):
+    # Where the facelet at every position moves to
+    dest = [0] * len(perm)
+    for i, j in enumerate(perm):
+        dest[j] = i
+    return dest
+
+@lru_cache(maxsize=None)
+def piece_orbits(n):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube
+
+    Description:
+        Groups the facelets into orbits: the sets of positions the moves can carry a facelet to.
+        Pieces with one facelet in every set of their orbit (wings and centers) can be solved with
+        3-cycles, the other pieces (corners, middle edges, the middle centers) belong to the frame.
+
+    Output:
+        List of orbits, every orbit a list of slots (one tuple of facelet indices per piece,
+        the facelets in the order of the sets).
+    """
+    size = 6 * n * n
+    parent = list(range(size))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    for a in move_actions(n):
+        for i, j in enumerate(move_permutation(n, a)):
+            parent[find(i)] = find(j)
+
+    # Facelets of the same piece share the cubie coordinate (the facelet coordinate moved one step inwards)
+    pieces = {}
+    for i, p in enumerate(facelet_coordinates(n)):
+        pieces.setdefault(tuple(x - (x > 0) + (x < 0) if abs(x) == n else x for x in p), []).append(i)
+
+    orbits = {}
+    for facelets in pieces.values():
+        sets = sorted(find(i) for i in facelets)
+        if len(set(sets)) != len(sets):
+            continue
+        order = {find(i): i for i in facelets}
+        orbits.setdefault(tuple(sets), []).append(tuple(order[s] for s in sets))
+    return [sorted(slots) for _, slots in sorted(orbits.items()) if len(slots) > 6]
+
+@lru_cache(maxsize=None)
+def _commutator(n, index):
+    """
+    Searches a pure 3-cycle of an orbit: commutators [A, B] with A a move or a conjugate X Y X'
+    and B a move, whose supports meet in one piece of the orbit. Returns the moves and the
+    three tracked facelets it cycles (the piece at the first goes to the second, ...).
+    """
+    orbit = piece_orbits(n)[index]
+    tracked = {s[0] for s in orbit}
+    width = len(orbit[0])
+    actions = move_actions(n)
+    moved = {a: {i for i, j in enumerate(move_permutation(n, a)) if i != j} for a in actions}
+    candidates = [(a,) for a in actions]
+    candidates += [(x, y, _inverse(x)) for x in actions for y in actions if x[0] != y[0]]
+    for first in candidates:
+        p = _sequence_permutation(n, first)
+        support = {i for i, j in enumerate(p) if i != j}
+        for b in actions:
+            meet = support & moved[b]
+            if not meet or len(meet) > width or not meet & tracked:
+                continue
+            moves = list(first) + [b] + [_inverse(a) for a in reversed(first)] + [_inverse(b)]
+            perm = _sequence_permutation(n, moves)
+            changed = [i for i, j in enumerate(perm) if i != j]
+            cycled = [i for i in changed if i in tracked]
+            if len(changed) != 3 * width or len(cycled) != 3:
+                continue
+            dest = _destinations(perm)
+            a = cycled[0]
+            return moves, (a, dest[a], dest[dest[a]])
+    raise ValueError(f'no 3-cycle found for orbit {index} of the {n}x{n} cube')
+
+@lru_cache(maxsize=None)
+def _setups(n, index):
+    """
+    Breadth-first search over the ordered triples of tracked facelets of an orbit, starting
+    at the triple of its commutator. Returns a dictionary mapping every triple to the
+    (previous triple, move) it was reached with.
+    """
+    orbit = piece_orbits(n)[index]
+    tracked = {s[0] for s in orbit}
+    _, start = _commutator(n, index)
+    moves = []
+    for a in move_actions(n):
+        dest = _destinations(move_permutation(n, a))
+        if any(dest[t] != t for t in tracked):
+            moves.append((a, dest))
+    parents = {start: None}
+    layer = [start]
+    while layer:
+        children = []
+        for triple in layer:
+            x, y, z = triple
+            for a, dest in moves:
+                child = (dest[x], dest[y], dest[z])
+                if child not in parents:
+                    parents[child] = (triple, a)
+                    children.append(child)
+        layer = children
+    return parents
+
+def cycle_moves(n, index, triple):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube
+        index (int): The orbit (see piece_orbits)
+        triple (tuple): Three tracked facelets of the orbit
+
+    Description:
+        Builds the pure 3-cycle that moves the piece at the first facelet to the second,
+        the second to the third and the third to the first: setup moves that carry the three
+        pieces to the ones the commutator cycles, the commutator and the setup undone.
+
+    Output:
+        List of move tuples.
+    """
+    parents = _setups(n, index)
+    path = []
+    while parents[triple] is not None:
+        triple, a = parents[triple]
+        path.append(a)
+    # The path moves carry the commutator triple to the requested one, their inverses carry it back
+    setup = [_inverse(a) for a in path]
+    commutator, _ = _commutator(n, index)
+    return setup + commutator + [_inverse(a) for a in reversed(setup)]
+
+@lru_cache(maxsize=None)
+def _parity_moves(n):
+    # For every orbit a slice turn that is an odd permutation of its pieces and does not touch the frame
+    moves = {}
+    for index, orbit in enumerate(piece_orbits(n)):
+        tracked = [s[0] for s in orbit]
+        for layer in range(1, n - 1):
+            if n % 2 and layer == n // 2:
+                continue
+            dest = _destinations(move_permutation(n, ('h', layer, 0)))
+            if _parity([tracked.index(dest[t]) for t in tracked]):
+                moves[index] = ('h', layer, 0)
+                break
+    return moves
+
+@lru_cache(maxsize=None)
+def frame_facelets(n):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube
+
+    Description:
+        Lists the facelets of the big cube that form the 3x3 frame, in 3x3 facelet order:
+        rows and columns 0, n//2 and n-1 for odd n. For even n only the corners are
+        taken, the other positions are None.
+
+    Output:
+        List of 54 facelet indices (or None).
+    """
+    lines = [0, n // 2, n - 1] if n % 2 else [0, None, n - 1]
+    return [None if r is None or c is None else f * n * n + r * n + c
+            for f in range(6) for r in lines for c in lines]
+
+@lru_cache(maxsize=None)
+def _rotated_solved():
+    solved = solved_state(3)
+    return [bytes(solved[i] for i in transform_permutation(3, m)) for m in cube_symmetries()]
+
+class ReductionSolver(object):
+    def __init__(self, tables, colors = None, time_budget = None):
+        """
+        Input:
+            tables (dict): The tables of kociemba.load_two_phase_tables
+            colors (list): colors in the index order of the faces (Default: None, the default cube colors)
+            time_budget (float): Seconds the two-phase solver improves the frame solution (Default: None)
+
+        Description:
+            Solver for cubes of any size (see the module comment). The solutions are far from
+            optimal (a few hundred to a few thousand moves) but are found within seconds.
+
+        Output:
+            None
+        """
+        self.colors = colors or ['w', 'o', 'g', 'r', 'b', 'y']
+        self.frame_solver = Kociemba(tables, colors = self.colors, time_budget = time_budget)
+        self.max_depth = None
+        self.moves = []
+        self.nodes = 0
+
+    def run(self, state):
+        """
+        Input:
+            state (str): representing the current state of the cube
+
+        Description:
+            Solves the frame, then the wing orbits and the center orbits.
+            Raises a ValueError if the state can not be solved.
+
+        Output:
+            list containing the moves taken to solve the cube
+        """
+        n = int((len(state) / 6) ** (.5))
+        flat, _ = encode_state(state, self.colors)
+        self.n = n
+        self.state = flat
+        self.moves = []
+        self.nodes = 0
+        table = move_table(n)
+        self.table = table
+
+        self.solve_frame()
+        self.nodes += self.frame_solver.nodes
+
+        # The frame fixes the color of every face
+        faces = [self.state[f * n * n] for f in range(6)]
+        orbits = piece_orbits(n)
+        wings = [i for i, o in enumerate(orbits) if len(o[0]) == 2]
+        centers = [i for i, o in enumerate(orbits) if len(o[0]) == 1]
+        for index in wings + centers:
+            self.solve_orbit(index, faces)
+
+        if not is_solved(self.state, n):
+            raise ValueError('the state is not solvable')
+        self.moves = _simplify(self.moves)
+        return self.moves
+
+    def apply(self, moves):
+        for a in moves:
+            self.state = bytes(self.table[a](self.state))
+        self.moves.extend(moves)
+
+    def solve_frame(self):
+        """
+        Input:
+            None
+
+        Description:
+            Solves the pieces of the 3x3 frame with the two-phase solver, its face moves
+            turn the outer layers of the big cube.
+
+        Output:
+            None
+        """
+        n = self.n
+        outer = {0: 0, 1: n // 2, 2: n - 1}
+        for _ in range(2):
+            frame = self.frame_state()
+            if frame is not None:
+                break
+            # The corners of an even cube can be an odd permutation, one face turn fixes that
+            self.apply([('h', 0, 0)])
+        else:
+            raise ValueError('the state is not solvable')
+        moves = self.frame_solver.run(decode_state(frame, self.colors))
+        self.apply([(t, outer[layer], d) for t, layer, d in moves])
+
+    def frame_state(self):
+        """
+        Input:
+            None
+
+        Description:
+            Builds the 3x3 state of the frame. For even n the corners are combined with the solved
+            edges and centers of every orientation until the result is solvable.
+
+        Output:
+            The flat 3x3 state (bytes) or None if no solvable one exists.
+        """
+        facelets = frame_facelets(self.n)
+        if self.n % 2:
+            return bytes(self.state[i] for i in facelets)
+        for base in _rotated_solved():
+            frame = bytes(base[k] if i is None else self.state[i] for k, i in enumerate(facelets))
+            try:
+                if is_solvable(*facelets_to_cubies(frame)):
+                    return frame
+            except ValueError:
+                continue
+        return None
+
+    def solve_orbit(self, index, faces):
+        """
+        Input:
+            index (int): The orbit (see piece_orbits)
+            faces (list): The color of every face
+
+        Description:
+            Brings every piece of the orbit home with 3-cycles. Wing orbits that are an odd
+            permutation get a slice turn first (pieces of one color are interchangeable,
+            so center orbits never need it).
+
+        Output:
+            None
+        """
+        n, n2 = self.n, self.n * self.n
+        orbit = piece_orbits(n)[index]
+        want = {s: tuple(faces[i // n2] for i in s) for s in orbit}
+        def current(s):
+            return tuple(self.state[i] for i in s)
+
+        if len(orbit[0]) > 1:
+            home = {w: s for s, w in want.items()}
+            if len(home) != len(orbit) or any(current(s) not in home for s in orbit):
+                raise ValueError('the state is not solvable')
+            position = {s: k for k, s in enumerate(orbit)}
+            if _parity([position[home[current(s)]] for s in orbit]):
+                self.apply([_parity_moves(n)[index]])
+
+        while True:
+            wrong = [s for s in orbit if current(s) != want[s]]
+            if not wrong:
+                return
+            x = wrong[0]
+            # A wrong slot that wants the piece of x, and a third slot that wants the piece of y if possible
+            y = next((s for s in wrong if want[s] == current(x)), None)
+            if y is None:
+                raise ValueError('the state is not solvable')
+            z = (next((s for s in wrong if s not in (x, y) and want[s] == current(y)), None)
+                 or next((s for s in wrong if s not in (x, y)), None)
+                 or next((s for s in orbit if s not in (x, y) and want[s] == current(y)), None))
+            if z is None:
+                raise ValueError('the state is not solvable')
+            self.apply(cycle_moves(n, index, (x[0], y[0], z[0])))
+
+def _simplify(moves):
+    """
+    Cancels moves that undo each other and replaces three equal quarter turns by one the other way.
+    """
+    result = []
+    for a in moves:
+        if result and result[-1] == _inverse(a):
+            result.pop()
+        elif len(result) > 1 and result[-1] == a and result[-2] == a:
+            del result[-2:]
+            result.append(_inverse(a))
+            while len(result) > 1 and result[-2] == _inverse(result[-1]):
+                del result[-2:]
+        else:
+            result.append(a)
+    return result
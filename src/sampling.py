@@ -0,0 +1,240 @@
+import argparse
+import os
+import sys
+from random import Random
+
+from batch import DATA_DIR
+from cube import decode_state, solved_state, symmetric_states
+from cubie import CORNER_COLORS, CORNER_FACELETS, EDGE_COLORS, EDGE_FACELETS, _parity, cubies_to_facelets
+from database import HeuristicDB
+
+try:
+    import numpy as np
+except ImportError: # states are drawn one by one, arrays are not available
+    np = None
+
+#############################################
+#########   Random State Sampling   #########
+#############################################
+# Corpora for tests, benchmarks and soak runs without shuffling:
+#   random_state / random_states   uniformly random solvable 3x3 states, drawn as cubies: random corner and
+#                                  edge permutations of equal parity, random twists and flips adding up to zero
+#   LayerSampler                   uniformly random states exactly d moves from solved, drawn from the
+#                                  layers of a heuristic database (see database.HeuristicDB)
+# Every generator takes a seed, the same seed gives the same states (a longer corpus starts with the
+# states of a shorter one). With NumPy random_states draws CHUNK states at a time as arrays, that is
+# another stream than the state by state generator of the same seed.
+
+COLORS = ['w', 'o', 'g', 'r', 'b', 'y'] # default colors of RubiksCube
+CHUNK = 10000
+
+def random_cubies(rng):
+    """
+    Input:
+        rng (random.Random): Source of the random numbers
+
+    Description:
+        Draws a uniformly random solvable cubie state. Swapping the last two edges of an odd edge
+        permutation is a bijection, so fixing the parity that way keeps the distribution uniform.
+
+    Output:
+        Tuple (cp, co, ep, eo) of lists.
+    """
+    cp, ep = list(range(8)), list(range(12))
+    rng.shuffle(cp)
+    rng.shuffle(ep)
+    if _parity(cp) != _parity(ep):
+        ep[10], ep[11] = ep[11], ep[10]
+    co = [rng.randrange(3) for _ in range(7)]
+    eo = [rng.randrange(2) for _ in range(11)]
+    return cp, co + [-sum(co) % 3], ep, eo + [sum(eo) % 2]
+
+def random_state(rng = None):
+    """
+    Input:
+        rng (random.Random): Source of the random numbers (Default: None, a new unseeded one)
+
+    Description:
+        Draws a uniformly random solvable 3x3 state (see random_cubies).
+
+    Output:
+        The flat state (bytes) with every center on its own face.
+    """
+    return cubies_to_facelets(*random_cubies(rng or Random()))
+
+def _parity_array(perm):
+    n = perm.shape[1]
+    return sum((perm[:, j] > perm[:, i]).astype(np.uint8) for i in range(n) for j in range(i)) % 2
+
+def random_array(count, rng):
+    """
+    Input:
+        count (int): Number of states
+        rng (numpy.random.Generator): Source of the random numbers
+
+    Description:
+        Draws count uniformly random solvable 3x3 states at once, like random_cubies does for one state.
+        Needs NumPy.
+
+    Output:
+        (count, 54) uint8 array of flat states.
+    """
+    rows = np.arange(count)
+    cp = np.argsort(rng.random((count, 8)), axis=1)
+    ep = np.argsort(rng.random((count, 12)), axis=1)
+    odd = _parity_array(cp) != _parity_array(ep)
+    ep[odd, 10], ep[odd, 11] = ep[odd, 11], ep[odd, 10]
+    co = rng.integers(0, 3, (count, 8))
+    co[:, 7] = -co[:, :7].sum(axis=1) % 3
+    eo = rng.integers(0, 2, (count, 12))
+    eo[:, 11] = eo[:, :11].sum(axis=1) % 2
+
+    states = np.tile(np.frombuffer(solved_state(3), dtype=np.uint8), (count, 1))
+    for cubies, ori, facelets, colors, size in [(cp, co, CORNER_FACELETS, CORNER_COLORS, 3),
+                                                (ep, eo, EDGE_FACELETS, EDGE_COLORS, 2)]:
+        facelets, colors = np.array(facelets), np.array(colors, dtype=np.uint8)
+        for i in range(len(facelets)):
+            for k in range(size):
+                states[rows, facelets[i][(k + ori[:, i]) % size]] = colors[cubies[:, i], k]
+    return states
+
+def random_states(count, seed = None, as_array = False, colors = COLORS):
+    """
+    Input:
+        count (int): Number of states
+        seed (int): Seed of the generator (Default: None, not reproducible)
+        as_array (bool): Return a (count, 54) uint8 array of flat states instead of strings (Default: False)
+        colors (list): The colors of the strings in index order (Default: COLORS)
+
+    Description:
+        Draws uniformly random solvable 3x3 states, CHUNK at a time with NumPy. Every chunk
+        has its own generator spawned from the seed, so the states do not depend on count.
+        Raises a ValueError if an array is requested without NumPy.
+
+    Output:
+        List of state strings (see RubiksCube.stringify) or the array.
+    """
+    if np is None:
+        if as_array:
+            raise ValueError('state arrays need NumPy')
+        rng = Random(seed)
+        return [decode_state(random_state(rng), colors) for _ in range(count)]
+    seeds = np.random.SeedSequence(seed).spawn(-(-count // CHUNK))
+    states = np.concatenate([random_array(CHUNK, np.random.default_rng(s)) for s in seeds] or
+                            [np.empty((0, 54), dtype=np.uint8)])[:count]
+    if as_array:
+        return states
+    text = decode_state(states.tobytes(), colors)
+    return [text[i:i + 54] for i in range(0, len(text), 54)]
+
+class LayerSampler(object):
+    def __init__(self, table, seed = None):
+        """
+        Input:
+            table: Mapping of flat states to their distance, a HeuristicDB or the result of solver.build_heuristic_db
+            seed (int): Seed of the generator (Default: None, not reproducible)
+
+        Description:
+            Samples the states of one distance from the table. A table of canonical states stores one state
+            per class (see cube.canonical_state): a class is picked with a probability proportional to
+            its number of distinct states, then one of its states, so every state of the distance
+            is equally likely. The layers are read from the table once and kept.
+
+        Output:
+            None
+        """
+        self.table = table
+        self.rng = Random(seed)
+        self.canonical = getattr(table, 'canonical', False)
+        self.colors = getattr(table, 'colors', None) or COLORS
+        self.layers = {}
+
+    def layer(self, depth):
+        """
+        Input:
+            depth (int): A distance
+
+        Description:
+            Reads the states of the distance from the table.
+            Raises a ValueError if the table holds none.
+
+        Output:
+            List of flat states.
+        """
+        if depth not in self.layers:
+            if hasattr(self.table, 'layer'):
+                states = self.table.layer(depth)
+            else:
+                states = [s for s, d in self.table.items() if d == depth]
+            if not states:
+                reach = getattr(self.table, 'depth', None)
+                raise ValueError(f'the table holds no states {depth} moves from solved' +
+                                 (f' (it reaches depth {reach})' if reach is not None else ''))
+            self.layers[depth] = states
+        return self.layers[depth]
+
+    def sample(self, depth):
+        """
+        Input:
+            depth (int): A distance
+
+        Description:
+            Draws a uniformly random state of the distance.
+
+        Output:
+            The flat state (bytes).
+        """
+        states = self.layer(depth)
+        rng = self.rng
+        while True:
+            state = rng.choice(states)
+            if not self.canonical:
+                return state
+            copies = symmetric_states(state, int((len(state) / 6) ** (.5)))
+            # A copy appears as often as the symmetries of the state, so every distinct state is equally likely
+            if rng.random() * len(copies) < len(set(copies)):
+                return rng.choice(copies)
+
+    def states(self, depth, count):
+        """
+        Input:
+            depth (int): A distance
+            count (int): Number of states
+
+        Description:
+            Draws count states of the distance (see sample).
+
+        Output:
+            List of state strings (see RubiksCube.stringify).
+        """
+        return [decode_state(self.sample(depth), self.colors) for _ in range(count)]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Write uniformly random solvable 3x3 states, one per line (the input format of batch.py).')
+    parser.add_argument('count', type=int, help='number of states')
+    parser.add_argument('-o', '--output', default='-', help='output file (default: stdout)')
+    parser.add_argument('-s', '--seed', type=int, help='seed, the same seed gives the same states')
+    parser.add_argument('-d', '--depth', type=int, help='draw states exactly this many moves from solved (from heuristic.db)')
+    parser.add_argument('--data-dir', default=DATA_DIR, help='directory of the heuristic database')
+    args = parser.parse_args(argv)
+
+    if args.depth is None:
+        states = random_states(args.count, args.seed)
+    else:
+        path = os.path.join(args.data_dir, 'heuristic.db')
+        try:
+            with HeuristicDB(path) as db:
+                states = LayerSampler(db, args.seed).states(args.depth, args.count)
+        except (OSError, ValueError) as e:
+            print(f'ERROR - {e}', file=sys.stderr)
+            return 1
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        target.write(''.join(s + '\n' for s in states))
+    finally:
+        if target is not sys.stdout:
+            target.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,408 @@
+import argparse
+import asyncio
+import contextlib
+import http.client
+import json
+import os
+import socket
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from batch import DATA_DIR, METHODS, _solve, load_heuristic, make_solver, parse_cube
+from kociemba import load_two_phase_tables
+
+#############################################
+#########   Local Solver Service   ##########
+#############################################
+# python service.py serve --port 8765                   keep the databases warm and solve on request
+# python service.py serve --unix /tmp/cube.sock         the same on a Unix socket
+# python service.py solve "[('h', 0, 1)]"               send one cube to a running service
+# python service.py health                              queue depth, counters and latency
+#
+# HTTP/1.1 with JSON bodies, one request per connection:
+#   POST /solve   {"cube": <state or move list>, "method": "ida", "timeout": 10}
+#                 -> 200 {"moves": [...], "length": ..., "nodes": ..., "time": ..., "coalesced": false}
+#                    400 unreadable cube, 503 queue full (backpressure), 504 timeout, 422 not solved
+#   GET /health   -> 200 {"status": "ok", "queue": ..., "in_flight": ..., "latency": {...}, ...}
+# The databases are loaded once at startup, solves run on a process pool that inherits them.
+# Requests for the same cube and method that arrive while it is being solved share that solve.
+
+HOST = '127.0.0.1'
+PORT = 8765
+QUEUE_SIZE = 64
+TIMEOUT = 30
+LATENCY_WINDOW = 1000
+
+# Solvers of a service worker process (see _init_service_worker)
+_service_worker = {}
+
+def _init_service_worker(heuristics, max_depth, time_budget):
+    for method, heuristic in heuristics.items():
+        _service_worker[method] = make_solver(method, heuristic, max_depth, time_budget)
+
+def _solve_in_service(method, state, timeout):
+    # IDA* stops at the timeout and frees the worker, the two-phase solver is fast for any state
+    budget = {'time_budget': timeout} if method == 'ida' else {}
+    result = _solve(_service_worker[method], None, state, **budget)
+    result.pop('index', None)
+    if 'error' in result and result.get('status') == 'time':
+        result.update(error = f'no solution within {timeout:g}s', timeout = True)
+    return result
+
+class SolverService(object):
+    def __init__(self, heuristics, workers = 1, queue_size = QUEUE_SIZE, timeout = TIMEOUT, max_depth = None, time_budget = None):
+        """
+        Input:
+            heuristics (dict): Maps every served method to its heuristic or tables (see batch.make_solver)
+            workers (int): Number of solving processes, None for one per core (Default: 1)
+            queue_size (int): Solves waiting for a worker before requests are rejected (Default: QUEUE_SIZE)
+            timeout (float): Longest time a request may take in seconds, requests can ask for less (Default: TIMEOUT)
+            max_depth (int): Longest solution searched for (Default: None, the default of the solver)
+            time_budget (float): Seconds the two-phase solver improves its solution (Default: None)
+
+        Description:
+            The solver behind the server (see serve). Call start() within the event loop before solving.
+
+        Output:
+            None
+        """
+        self.heuristics = heuristics
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self.pending = {}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {'requests': 0, 'solved': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0, 'coalesced': 0}
+        self.in_flight = 0
+        self.pool = None
+
+    def start(self):
+        """
+        Input:
+            None
+
+        Description:
+            Starts the worker processes and the tasks that feed them from the queue.
+
+        Output:
+            None
+        """
+        self.started = time.time()
+        self.queue = asyncio.Queue(self.queue_size)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker,
+                                        initargs=(self.heuristics, self.max_depth, self.time_budget))
+        self.dispatchers = [asyncio.ensure_future(self.dispatch()) for _ in range(self.workers)]
+
+    async def close(self):
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def dispatch(self):
+        # One dispatcher per worker process, so a solve waits in the queue until a worker is free
+        loop = asyncio.get_running_loop()
+        while True:
+            key, deadline, future = await self.queue.get()
+            remaining = deadline - loop.time()
+            if future.done() or remaining <= 0:
+                if not future.done():
+                    future.set_result({'error': 'timed out in the queue', 'timeout': True})
+                self.pending.pop(key, None)
+                continue
+            self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self.pool, _solve_in_service, key[0], key[1], remaining)
+            except Exception as e:
+                result = {'error': f'worker failed: {e}'}
+            finally:
+                self.in_flight -= 1
+                self.pending.pop(key, None)
+            if 'moves' in result:
+                self.latencies.append(time.perf_counter() - start)
+            if not future.done():
+                future.set_result(result)
+
+    async def solve(self, cube, method = 'ida', timeout = None):
+        """
+        Input:
+            cube (str): A state string or a move list (see batch.parse_cube)
+            method (str): A served method (Default: 'ida')
+            timeout (float): Seconds to wait for the solution (Default: None, self.timeout)
+
+        Description:
+            Queues the cube or joins the solve of the same cube that is already queued or running.
+            Raises a ValueError if the cube or the method can not be used.
+
+        Output:
+            Tuple (HTTP status, result dictionary).
+        """
+        self.counters['requests'] += 1
+        if method not in self.heuristics:
+            raise ValueError(f'method {method!r} is not served, expected one of {sorted(self.heuristics)}')
+        state = parse_cube(cube)
+        timeout = self.timeout if timeout is None else min(float(timeout), self.timeout)
+        loop = asyncio.get_running_loop()
+        key = (method, state)
+
+        future = self.pending.get(key)
+        coalesced = future is not None
+        if coalesced:
+            self.counters['coalesced'] += 1
+        else:
+            future = loop.create_future()
+            try:
+                self.queue.put_nowait((key, loop.time() + timeout, future))
+            except asyncio.QueueFull:
+                self.counters['rejected'] += 1
+                return 503, {'error': 'the queue is full, try again later'}
+            self.pending[key] = future
+
+        try:
+            # Shielded, so a waiter that gives up does not cancel the solve the others wait for
+            result = dict(await asyncio.wait_for(asyncio.shield(future), timeout))
+        except asyncio.TimeoutError:
+            result = {'error': f'no solution within {timeout:g}s', 'timeout': True}
+        result['coalesced'] = coalesced
+        if result.pop('timeout', False):
+            self.counters['timeouts'] += 1
+            return 504, result
+        if 'error' in result:
+            self.counters['errors'] += 1
+            return 422, result
+        self.counters['solved'] += 1
+        return 200, result
+
+    def health(self):
+        """
+        Input:
+            None
+
+        Description:
+            Reports the queue, the counters and the latency percentiles of the last solves.
+
+        Output:
+            Dictionary (see the module comment).
+        """
+        latencies = sorted(self.latencies)
+        latency = {}
+        if latencies:
+            for p in (50, 90, 99):
+                latency[f'p{p}'] = latencies[min(len(latencies) - 1, int(round(p / 100 * (len(latencies) - 1))))]
+            latency['mean'] = sum(latencies) / len(latencies)
+        return {
+            'status': 'ok',
+            'methods': sorted(self.heuristics),
+            'workers': self.workers,
+            'queue': self.queue.qsize(),
+            'queue_size': self.queue_size,
+            'in_flight': self.in_flight,
+            'uptime': time.time() - self.started,
+            'latency': latency,
+            **self.counters
+        }
+
+    async def handle(self, reader, writer):
+        """
+        Input:
+            reader, writer: The streams of one connection
+
+        Description:
+            Reads one HTTP request, answers it and closes the connection.
+            An unexpected failure is answered with status 500.
+
+        Output:
+            None
+        """
+        try:
+            status, body = await self.respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            # The client gets an answer for any failure of the service
+            print(f'ERROR - {type(e).__name__}: {e}', file=sys.stderr)
+            self.counters['errors'] += 1
+            status, body = 500, {'error': f'internal error: {type(e).__name__}'}
+        data = json.dumps(body).encode()
+        writer.write(f'HTTP/1.1 {status} {http.client.responses.get(status, "")}\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n'.encode() + data)
+        with contextlib.suppress(ConnectionError):
+            await writer.drain()
+        writer.close()
+
+    async def respond(self, reader):
+        line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            header = (await reader.readline()).decode('latin-1')
+            if header in ('\r\n', '\n', ''):
+                break
+            name, _, value = header.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if len(line) < 2:
+            return 400, {'error': 'malformed request'}
+        verb, path = line[0], line[1]
+
+        if path == '/health':
+            return (200, self.health()) if verb == 'GET' else (405, {'error': 'use GET'})
+        if path != '/solve':
+            return 404, {'error': f'unknown path {path}'}
+        if verb != 'POST':
+            return 405, {'error': 'use POST'}
+        try:
+            length = int(headers.get('content-length', 0))
+            if length < 0:
+                raise ValueError(f'negative content length {length}')
+            body = await reader.readexactly(length)
+            request = json.loads(body or b'{}')
+            return await self.solve(request['cube'], request.get('method', 'ida'), request.get('timeout'))
+        except (ValueError, KeyError, TypeError) as e:
+            self.counters['errors'] += 1
+            return 400, {'error': f'bad request: {e}'}
+
+def load_heuristics(methods, directory = DATA_DIR, build = True):
+    """
+    Input:
+        methods (list): Methods to serve (see batch.METHODS)
+        directory (str): Directory of the database files (Default: the source directory)
+        build (bool): Build missing databases (Default: True)
+
+    Description:
+        Loads the databases of every method once.
+
+    Output:
+        Dictionary mapping the methods to their heuristic or tables.
+    """
+    heuristics = {}
+    for method in methods:
+        if method == 'kociemba':
+            heuristics[method] = load_two_phase_tables(directory, build = build)
+        else:
+            heuristics[method] = load_heuristic(directory, build = build)
+    return heuristics
+
+async def serve(service, host = HOST, port = PORT, unix = None, ready = None):
+    """
+    Input:
+        service (SolverService): The solver
+        host (str): Address to listen on (Default: HOST, localhost only)
+        port (int): Port to listen on, 0 for any free port (Default: PORT)
+        unix (str): Path of a Unix socket to listen on instead (Default: None)
+        ready (function): Called with the bound address once the server accepts connections (Default: None)
+
+    Description:
+        Runs the service until it is cancelled.
+
+    Output:
+        None
+    """
+    service.start()
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, unix)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+    address = server.sockets[0].getsockname()
+    if ready is not None:
+        ready(address)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout):
+        super().__init__('localhost', timeout = timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+def request(verb, path, body = None, host = HOST, port = PORT, unix = None, timeout = None):
+    """
+    Input:
+        verb (str): 'GET' or 'POST'
+        path (str): '/solve' or '/health'
+        body (dict): JSON body (Default: None)
+        host, port (str, int): Address of the service (Default: HOST, PORT)
+        unix (str): Path of the Unix socket of the service instead (Default: None)
+        timeout (float): Seconds to wait for the answer (Default: None, no limit)
+
+    Description:
+        Sends one request to a running service.
+
+    Output:
+        Tuple (HTTP status, result dictionary).
+    """
+    if unix is not None:
+        connection = _UnixConnection(unix, timeout)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout = timeout)
+    try:
+        data = None if body is None else json.dumps(body)
+        connection.request(verb, path, data, {'Content-Type': 'application/json'} if data else {})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Local solver service that keeps the databases loaded.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_parser = commands.add_parser('serve', help='load the databases and answer solve requests')
+    solve_parser = commands.add_parser('solve', help='send one cube to a running service')
+    health_parser = commands.add_parser('health', help='show the health and metrics of a running service')
+    for p in (serve_parser, solve_parser, health_parser):
+        p.add_argument('--host', default=HOST, help=f'address (default: {HOST})')
+        p.add_argument('--port', type=int, default=PORT, help=f'port (default: {PORT})')
+        p.add_argument('--unix', help='path of a Unix socket instead of host and port')
+    serve_parser.add_argument('-m', '--method', dest='methods', action='append', choices=METHODS,
+                              help='method to serve, can be repeated (default: ida)')
+    serve_parser.add_argument('-w', '--workers', type=int, default=1, help='solving processes, 0 for one per core (default: 1)')
+    serve_parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help=f'solves waiting before requests are rejected (default: {QUEUE_SIZE})')
+    serve_parser.add_argument('--timeout', type=float, default=TIMEOUT, help=f'longest time a request may take in seconds (default: {TIMEOUT})')
+    serve_parser.add_argument('--max-depth', type=int, help='longest solution searched for')
+    serve_parser.add_argument('--time-budget', type=float, help='seconds the two-phase solver keeps improving every solution')
+    serve_parser.add_argument('--data-dir', default=DATA_DIR, help='directory of the heuristic and pattern databases')
+    serve_parser.add_argument('--no-build', action='store_true', help='fail instead of building missing databases')
+    solve_parser.add_argument('cube', help='state string or move list')
+    solve_parser.add_argument('-m', '--method', choices=METHODS, default='ida', help='solver method (default: ida)')
+    solve_parser.add_argument('--timeout', type=float, help='seconds the service may take')
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        start = time.perf_counter()
+        heuristics = load_heuristics(args.methods or ['ida'], args.data_dir, build = not args.no_build)
+        service = SolverService(heuristics, args.workers or None, args.queue_size, args.timeout, args.max_depth, args.time_budget)
+        def ready(address):
+            print(f'serving {", ".join(sorted(heuristics))} on {address} (databases loaded in {time.perf_counter() - start:.2f}s)')
+        try:
+            asyncio.run(serve(service, args.host, args.port, args.unix, ready))
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    try:
+        if args.command == 'solve':
+            body = {'cube': args.cube, 'method': args.method}
+            if args.timeout is not None:
+                body['timeout'] = args.timeout
+            status, result = request('POST', '/solve', body, args.host, args.port, args.unix)
+        else:
+            status, result = request('GET', '/health', None, args.host, args.port, args.unix)
+    except OSError as e:
+        print(f'ERROR - can not reach the service: {e}')
+        return 1
+    print(json.dumps(result))
+    return 0 if status == 200 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
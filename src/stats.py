@@ -0,0 +1,293 @@
+import json
+import time
+from tqdm import tqdm
+
+#############################################
+#########   Search Instrumentation   ########
+#############################################
+# A SearchStats object collects the metrics of one search (an IDA_star run or a database build)
+# and passes every record to its sinks. A sink is any callable taking a record dictionary:
+#   {"event": "start", "kind": "ida", ...}                                 search started
+#   {"event": "iteration", "iteration": 3, "threshold": 9, "nodes": ...}   one IDA* iteration or BFS layer
+#   {"event": "checkpoint", ...}                                           progress of a long layer was saved
+#   {"event": "end", "iterations": 5, "nodes": ..., "time": ...}           totals (see SearchStats.summary)
+# Searches without a stats object skip all of this, so instrumentation costs nothing when disabled.
+
+class SearchStats(object):
+    def __init__(self, sinks = ()):
+        """
+        Input:
+            sinks (iterable): Callables that get every record (Default: (), only collect)
+
+        Description:
+            Collects the metrics of a search. Iteration records get these fields computed:
+                time: seconds since begin()
+                ebf: effective branching factor, states of this layer (or nodes of this iteration) over the last one
+                hits, misses, hit_rate: heuristic lookups that found the state (see counting)
+                avg_h: mean of the looked up estimates
+            The records of the current search are kept in self.iterations.
+
+        Output:
+            None
+        """
+        self.sinks = list(sinks)
+        self.reset()
+
+    def reset(self):
+        """
+        Input:
+            None
+
+        Description:
+            Clears the records and counters for a new search.
+
+        Output:
+            None
+        """
+        self.iterations = []
+        self.hits = 0
+        self.misses = 0
+        self.h_sum = 0
+        self.h_count = 0
+        self.started = time.perf_counter()
+        self.mark = (self.started, 0, 0, 0, 0)
+
+    def emit(self, event, **fields):
+        """
+        Input:
+            event (str): 'start', 'iteration', 'checkpoint' or 'end'
+            fields: The fields of the record
+
+        Description:
+            Passes a record to every sink.
+
+        Output:
+            The record (dict).
+        """
+        record = {'event': event, **fields}
+        for sink in self.sinks:
+            sink(record)
+        return record
+
+    def start(self, kind, **fields):
+        """
+        Input:
+            kind (str): The kind of search, e.g. 'ida' or 'heuristic_db'
+            fields: Further fields of the start record, e.g. desc, total and initial for progress bars
+
+        Description:
+            Resets the stats and reports the start of a search.
+
+        Output:
+            None
+        """
+        self.reset()
+        self.emit('start', kind=kind, **fields)
+
+    def begin(self):
+        """
+        Input:
+            None
+
+        Description:
+            Marks the start of an iteration.
+
+        Output:
+            None
+        """
+        self.mark = (time.perf_counter(), self.hits, self.misses, self.h_sum, self.h_count)
+
+    def iteration(self, **fields):
+        """
+        Input:
+            fields: The metrics the search measured itself, e.g. threshold, nodes, expanded, depth, states
+
+        Description:
+            Completes and reports the record of the iteration since begin().
+
+        Output:
+            The record (dict).
+        """
+        start, hits, misses, h_sum, h_count = self.mark
+        hits, misses = self.hits - hits, self.misses - misses
+        h_sum, h_count = self.h_sum - h_sum, self.h_count - h_count
+        key = 'states' if 'states' in fields else 'nodes'
+        last = self.iterations[-1].get(key) if self.iterations else None
+        fields.update(
+            iteration = len(self.iterations) + 1,
+            time = time.perf_counter() - start,
+            ebf = fields[key] / last if last and fields.get(key) is not None else None
+        )
+        if hits or misses:
+            fields.update(hits = hits, misses = misses, hit_rate = hits / (hits + misses))
+        if h_count:
+            fields['avg_h'] = h_sum / h_count
+        record = self.emit('iteration', **fields)
+        self.iterations.append(record)
+        return record
+
+    def finish(self, **fields):
+        """
+        Input:
+            fields: Further fields of the end record, e.g. the solution length
+
+        Description:
+            Reports the totals of the search.
+
+        Output:
+            The summary (dict).
+        """
+        summary = self.summary()
+        summary.update(fields)
+        self.emit('end', **summary)
+        return summary
+
+    def summary(self):
+        """
+        Input:
+            None
+
+        Description:
+            Sums up the iterations of the current search.
+
+        Output:
+            Dictionary with the number of iterations, nodes, expanded nodes, lookups and the time.
+        """
+        summary = {'iterations': len(self.iterations), 'time': time.perf_counter() - self.started}
+        for key in ['nodes', 'expanded', 'states']:
+            values = [r[key] for r in self.iterations if r.get(key) is not None]
+            if values:
+                summary[key] = sum(values)
+        if self.hits or self.misses:
+            summary.update(hits = self.hits, misses = self.misses, hit_rate = self.hits / (self.hits + self.misses))
+        if self.h_count:
+            summary['avg_h'] = self.h_sum / self.h_count
+        return summary
+
+    def counting(self, get, counts = False):
+        """
+        Input:
+            get (function): Heuristic lookup (state, default) -> estimate
+            counts (bool): get counts its table hits itself, it takes the stats as third argument (Default: False)
+
+        Description:
+            Wraps a heuristic lookup so it counts hits (the state was found), misses (the default
+            was returned) and the sum of the estimates.
+
+        Output:
+            Function (state, default) -> estimate.
+        """
+        if counts:
+            def lookup(state, default = None):
+                h = get(state, default, self)
+                self.h_sum += h
+                self.h_count += 1
+                return h
+            return lookup
+
+        def lookup(state, default = None):
+            h = get(state)
+            if h is None:
+                self.misses += 1
+                h = default
+            else:
+                self.hits += 1
+            if h is not None:
+                self.h_sum += h
+                self.h_count += 1
+            return h
+        return lookup
+
+    def add_counts(self, hits, misses, h_sum, h_count):
+        """
+        Input:
+            hits, misses, h_sum, h_count (int): Counters of another SearchStats (see counts)
+
+        Description:
+            Adds the lookups counted in a worker process.
+
+        Output:
+            None
+        """
+        self.hits += hits
+        self.misses += misses
+        self.h_sum += h_sum
+        self.h_count += h_count
+
+    def counts(self):
+        return self.hits, self.misses, self.h_sum, self.h_count
+
+class TqdmSink(object):
+    def __init__(self, desc = None):
+        """
+        Input:
+            desc (str): Label of the progress bar (Default: None, the desc of the start record)
+
+        Description:
+            Sink that shows a progress bar (one step per iteration) and writes one line per iteration.
+
+        Output:
+            None
+        """
+        self.desc = desc
+        self.pbar = None
+
+    def __call__(self, record):
+        event = record['event']
+        if event == 'start':
+            self.close()
+            self.pbar = tqdm(total=record.get('total'), initial=record.get('initial', 0), desc=self.desc or record.get('desc'))
+        elif event == 'iteration':
+            tqdm.write(format_record(record))
+            if self.pbar is not None:
+                self.pbar.update(1)
+        elif event == 'end':
+            self.close()
+
+    def close(self):
+        if self.pbar is not None:
+            self.pbar.close()
+            self.pbar = None
+
+class JsonlSink(object):
+    def __init__(self, file):
+        """
+        Input:
+            file: Writable text file
+
+        Description:
+            Sink that writes every record as one JSON line.
+
+        Output:
+            None
+        """
+        self.file = file
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+def format_record(record):
+    """
+    Input:
+        record (dict): An iteration record
+
+    Description:
+        Formats a record as one line of text: layers of a breadth-first search as
+        'depth 5: 1234 states (0.12s)', IDA* iterations with their threshold and metrics.
+
+    Output:
+        The line (str).
+    """
+    if 'depth' in record:
+        return f'depth {record["depth"]}: {record["states"]} states ({record["time"]:.2f}s)'
+    line = f'threshold {record["threshold"]}: {record["nodes"]} nodes'
+    if record.get('expanded') is not None:
+        line += f', {record["expanded"]} expanded'
+    if record.get('ebf') is not None:
+        line += f', ebf {record["ebf"]:.2f}'
+    if record.get('avg_h') is not None:
+        line += f', avg h {record["avg_h"]:.2f}'
+    if record.get('hit_rate') is not None:
+        line += f', hit rate {record["hit_rate"]:.1%}'
+    return line + f' ({record["time"]:.2f}s)'
@@ -0,0 +1,264 @@
+from functools import lru_cache
+import numpy as np
+
+from cube import canonical_state, cube_symmetries, recolor_state, move_actions, move_permutation, transform_permutation, zobrist_keys
+
+#############################################
+#########   Vectorized Move Engine   ########
+#############################################
+# The flat engine of cube.py for many states at once: N states are an (N, 6*n*n) uint8 array,
+# every move is an index vector, so the children of a whole frontier under one move are a single
+# fancy-index operation (children = states[:, move]). Used by the database builders to expand
+# their frontiers; needs NumPy, without it they fall back to the per-state gathers.
+
+# Frontier states expanded at once, bounds the temporary arrays to about 100 MB
+CHUNK = 20000
+
+@lru_cache(maxsize=None)
+def move_indices(n = 3, actions = None):
+    """
+    Input:
+        n (int): The width and height of the Rubik's cube (Default: 3)
+        actions (tuple): The move tuples (Default: None, every move in move_actions order)
+
+    Description:
+        Stacks the facelet permutations of the moves (see cube.move_permutation).
+
+    Output:
+        (moves, 6*n*n) index array, the children of a state array are states[:, indices[m]].
+    """
+    actions = move_actions(n) if actions is None else actions
+    return np.array([move_permutation(n, a) for a in actions], dtype=np.intp)
+
+def to_array(states, n = 3):
+    """
+    Input:
+        states (iterable): Flat states (bytes)
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Stacks flat states into one array.
+
+    Output:
+        (N, 6*n*n) uint8 array.
+    """
+    return np.frombuffer(b''.join(states), dtype=np.uint8).reshape(-1, 6 * n * n)
+
+def to_states(array):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+
+    Description:
+        Splits a state array into flat states.
+
+    Output:
+        List of flat states (bytes).
+    """
+    size = array.shape[1]
+    data = np.ascontiguousarray(array).tobytes()
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def apply_moves(array, indices):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        indices (ndarray): (M, 6*n*n) move index array (see move_indices)
+
+    Description:
+        Applies every move to every state.
+
+    Output:
+        (N*M, 6*n*n) array, the children of state i are the rows i*M to i*M+M-1.
+    """
+    return np.take(array, indices, axis=1).reshape(-1, array.shape[1])
+
+@lru_cache(maxsize=None)
+def _canonical_arrays(n):
+    # The center facelets, the 48 symmetries and for every symmetry the recoloring that brings its centers home
+    n2 = n * n
+    centers = [f * n2 + n2 // 2 for f in range(6)]
+    symmetries = np.array([transform_permutation(n, m) for m in cube_symmetries(reflections=True)], dtype=np.intp)
+    recolor = np.zeros((len(symmetries), 6), dtype=np.uint8)
+    for k, perm in enumerate(symmetries):
+        for f, c in enumerate(centers):
+            recolor[k, perm[c] // n2] = f
+    return np.array(centers, dtype=np.intp), symmetries, recolor
+
+def recolor(array, n = 3):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Relabels the colors of every state (see cube.recolor_state).
+        Even n are relabeled state by state.
+
+    Output:
+        (N, 6*n*n) uint8 array of the relabeled states.
+    """
+    if n % 2 == 0:
+        return to_array([recolor_state(s, n) for s in to_states(array)], n)
+    centers = _canonical_arrays(n)[0]
+    rows = np.arange(len(array))[:, None]
+    home = np.empty((len(array), 6), dtype=np.uint8)
+    home[rows, array[:, centers]] = np.arange(6, dtype=np.uint8)
+    return home[rows, array]
+
+def canonical(array, n = 3):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Maps every state to its canonical state (see cube.canonical_state). For odd n the
+        states are recolored so the centers are home, then the 48 recolored symmetric copies
+        are compared one facelet at a time: only the copies that are still smallest take part
+        in the next facelet, and a state drops out as soon as one copy is left. The full copy
+        is only built for the winner (tied copies are equal).
+        Even n are canonicalized state by state.
+
+    Output:
+        (N, 6*n*n) uint8 array of the canonical states.
+    """
+    if n % 2 == 0:
+        return to_array([canonical_state(s, n) for s in to_states(array)], n)
+
+    _, symmetries, recolors = _canonical_arrays(n)
+    rows = np.arange(len(array))[:, None]
+    state = recolor(array, n)
+
+    copies = np.arange(len(symmetries))[None, :]
+    winner = np.zeros(len(array), dtype=np.intp)
+    active = np.arange(len(array))
+    tied = np.ones((len(array), len(symmetries)), dtype=bool)
+    part = state
+    for j in range(array.shape[1]):
+        # Facelet j of every copy, 255 for the copies that already lost
+        facelet = recolors[copies, part[:, symmetries[:, j]]]
+        facelet[~tied] = 255
+        tied &= facelet == facelet.min(axis=1)[:, None]
+        done = tied.sum(axis=1) == 1
+        winner[active[done]] = tied[done].argmax(axis=1)
+        active, tied, part = active[~done], tied[~done], part[~done]
+        if not len(active):
+            break
+    winner[active] = tied.argmax(axis=1)
+    return recolors[winner[:, None], state[rows, symmetries[winner]]]
+
+def unique(array, exclude = ()):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        exclude (iterable): State arrays whose states are dropped (Default: ())
+
+    Description:
+        Removes duplicate states with np.unique on the rows packed to two facelets per byte.
+
+    Output:
+        Array of the distinct states that are in none of the excluded arrays.
+    """
+    excluded = sum(len(e) for e in exclude)
+    stacked = np.concatenate(list(exclude) + [array]) if excluded else array
+    packed = np.ascontiguousarray((stacked[:, 0::2] << 4) | stacked[:, 1::2])
+    keys = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    # The index of the first occurrence is returned, so a state of an excluded array wins
+    _, first = np.unique(keys, return_index=True)
+    return stacked[np.sort(first[first >= excluded])]
+
+@lru_cache(maxsize=None)
+def _zobrist_table(n):
+    return np.array(zobrist_keys(n), dtype=np.uint64).reshape(6 * n * n, 6)
+
+def zobrist(array, n = 3):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        n (int): The width and height of the Rubik's cube (Default: 3)
+
+    Description:
+        Computes the 64-bit Zobrist hash of every state: the XOR of the keys of its facelets
+        (see cube.zobrist_keys).
+
+    Output:
+        (N,) uint64 array.
+    """
+    return np.bitwise_xor.reduce(_zobrist_table(n)[np.arange(array.shape[1]), array], axis=1)
+
+def child_hashes(array, hashes, indices):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        hashes (ndarray): (N,) Zobrist hashes of the states (see zobrist)
+        indices (ndarray): (M, 6*n*n) move index array (see move_indices)
+
+    Description:
+        Updates the hashes for every move from the facelets the move touches only: their old
+        colors are XORed out and the colors they receive are XORed in.
+
+    Output:
+        (N*M,) uint64 array in the row order of apply_moves.
+    """
+    n = int((array.shape[1] / 6) ** (.5))
+    keys = _zobrist_table(n)
+    facelets = np.arange(array.shape[1])
+    children = np.empty((len(array), len(indices)), dtype=np.uint64)
+    for m, perm in enumerate(indices):
+        touched = facelets[perm != facelets]
+        delta = keys[touched, array[:, perm[touched]]] ^ keys[touched, array[:, touched]]
+        children[:, m] = hashes ^ np.bitwise_xor.reduce(delta, axis=1)
+    return children.ravel()
+
+def unique_hashed(array, hashes):
+    """
+    Input:
+        array (ndarray): (N, 6*n*n) state array
+        hashes (ndarray): (N,) Zobrist hashes of the states
+
+    Description:
+        Removes duplicate states by sorting the 64-bit hashes instead of the rows. Every state
+        dropped as a duplicate is compared with the state it duplicates, on a hash collision
+        the rows are deduplicated by unique instead.
+
+    Output:
+        Array of the distinct states.
+    """
+    order = np.argsort(hashes)
+    ordered = hashes[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = ordered[1:] != ordered[:-1]
+    kept = order[np.maximum.accumulate(np.where(first, np.arange(len(order)), 0))]
+    if (array[order[~first]] != array[kept[~first]]).any():
+        return unique(array)
+    return array[np.sort(order[first])]
+
+def expand(states, indices, canonical_n = None):
+    """
+    Input:
+        states (iterable): Flat states (bytes) to expand
+        indices (ndarray): (M, 6*n*n) move index array (see move_indices)
+        canonical_n (int): cube size to canonicalize the children for, None to relabel their colors only (Default: None)
+
+    Description:
+        Applies every move to every state, CHUNK states at a time, canonicalizes
+        and deduplicates the children of every chunk. Children that are not canonicalized
+        are deduplicated by their Zobrist hashes, updated from the hashes of their parents,
+        and then relabeled (see recolor).
+
+    Output:
+        Set of the children (bytes).
+    """
+    states = list(states)
+    n = int((indices.shape[1] / 6) ** (.5))
+    layer = set()
+    for i in range(0, len(states), CHUNK):
+        parents = to_array(states[i:i + CHUNK], n)
+        children = apply_moves(parents, indices)
+        if canonical_n is not None:
+            children = unique(canonical(children, canonical_n))
+        else:
+            children = recolor(unique_hashed(children, child_hashes(parents, zobrist(parents, n), indices)), n)
+        layer.update(to_states(children))
+    return layer